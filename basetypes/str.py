@@ -1,5 +1,5 @@
 import re
-import pandas as pd
+import pandas as pd, numpy as np
 from itertools import chain
 # str.py - categorizers for values 
 
@@ -93,6 +93,98 @@ def cat05(series):
     "Return length of value. 2014-03-04"
     return series.groupby(_grouper(series).str.len().astype(str)).sum()
 
+###############################################################################
+# Categorizer-engine: the categorizers above applied to the same frequencies at once. The character-class 
+# categorizers are computed with translation-tables on all distinct values joined in one string, the compressed and
+# present variants on the frequencies of the categorizer they derive from (so per distinct signature instead of 
+# per distinct value). The results are identical to the functions, which stay the reference (and the source of the
+# hashes of the cached corpora).
+###############################################################################
+
+_SEPARATOR = '\x00'
+_LOWER, _UPPER, _DIGITS = 'abcdefghijklmnopqrstuvwxyz', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', '0123456789'
+_VOWELS, _SPACES, _SPECIALS = 'AEIOUaeiou', ' \t\n\r\f\v', '.-:;,@|'
+
+def _signature(classes, default, delete=False, collapse=''):
+    """Return the translation-table, the characters to delete and the regular expression for the runs to collapse
+    for a character-class categorizer. The classes are pairs of characters and their class, the first class of a
+    character wins; all other characters get the default class, or are deleted."""
+    table = [None] * 256
+    for characters, cls in classes:
+        for c in characters:
+            if table[ord(c)] is None: table[ord(c)] = cls
+    others = [chr(i) for i in range(256) if table[i] is None and chr(i) != _SEPARATOR]
+    table = ''.join([c if c is not None else default for c in table])
+    table = table[:ord(_SEPARATOR)] + _SEPARATOR + table[ord(_SEPARATOR) + 1:]
+    return table, ''.join(others) if delete else '', re.compile('([{}])\\1+'.format(collapse)) if collapse else None
+
+_signatures = {'cat85': _signature(((_VOWELS, 'a'), (_LOWER + _UPPER, 'c'), (_SPACES, 's'), (_SPECIALS, 'x'), (_DIGITS, 'd')), 'n', collapse='xn'),
+               'cat80': _signature(((_LOWER, 'c'), (_UPPER, 'C'), (_SPACES, 's'), (_SPECIALS, 'x'), (_DIGITS, 'd')), 'n', collapse='xn'),
+               'cat70': _signature(((_LOWER + _UPPER, 'c'), (_SPACES, 's'), (_SPECIALS, 'x'), (_DIGITS, 'd')), 'n', collapse='xn'),
+               'cat65': _signature(((_LOWER + _UPPER, 'c'), (_DIGITS, 'd')), 'x', collapse='x'),
+               'cat60': _signature(((_LOWER + _UPPER, 'c'), (_DIGITS, 'd')), 'x', delete=True),
+               'cat40': _signature(((_LOWER + _UPPER + _DIGITS, 'w'),), 'x')}
+_derived = {'cat55': ('cat85', _value_compressed), 'cat50': ('cat80', _value_compressed), 
+            'cat35': ('cat40', _value_compressed), 'cat30': ('cat70', _value_compressed),
+            'cat26': ('cat85', _value_present), 'cat23': ('cat80', _value_present), 
+            'cat20': ('cat70', _value_present), 'cat10': ('cat65', _value_present)}
+
+def _texts(values):
+    """Return the values as str: unicode is ascii-encoded with a replacement character of class other, like the 
+    regular expressions treat non-ascii characters."""
+    return [v if isinstance(v, str) else v.encode('ascii', 'replace') for v in values]
+
+def _translate(texts, table, delete, collapse):
+    """Return the signatures of the texts (str without the separator), all joined by the separator and translated 
+    at once."""
+    if not texts:
+        return []
+    joined = _SEPARATOR.join(texts).translate(table, delete)
+    return (collapse.sub(r'\1', joined) if collapse else joined).split(_SEPARATOR)
+
+class Categorizer(object):
+    """The categorizers for the frequencies of the distinct values of a sample or corpus (the argument of a 
+    cat-function), computed once per categorizer: categorizer(cat85) returns cat85(series). The categorizers of
+    this module are computed by the engine, other functions (e.g. the type-specific categorizers) are called.
+    Derived categorizers reuse their base: cat55 and cat26 are computed on the result of cat85."""
+    def __init__(self, series):
+        self.series = series
+        self._results = {}
+        self._strings = None
+    def strings(self):
+        "Return whether all distinct values are strings, which the engine requires."
+        if self._strings is None:
+            self._strings = all([isinstance(v, basestring) for v in self.series.index])
+        return self._strings
+    def name(self, func):
+        "Return the name of the categorizer when the engine computes it, otherwise None."
+        name = getattr(func, 'func_name', None)
+        return name if (name in _signatures or name in _derived) and globals().get(name) is func and self.strings() else None
+    def __call__(self, func):
+        key = self.name(func) or func
+        if key not in self._results:
+            if key in _signatures:
+                texts = _texts(self.series.index)
+                plain = np.array([_SEPARATOR not in t for t in texts], dtype=bool)
+                if not plain.any():
+                    # Nothing for the engine, e.g. an empty series:
+                    self._results[key] = func(self.series)
+                else:
+                    signatures = _translate([t for t, p in zip(texts, plain) if p], *_signatures[key])
+                    result = self.series[plain].groupby(np.array(signatures, dtype=object)).sum()
+                    if not plain.all():
+                        # The separator itself can't be translated in the joined values, the function does these:
+                        result = pd.concat([result, func(self.series[~plain])]).groupby(level=0).sum()
+                    self._results[key] = result
+            elif key in _derived:
+                base, value_func = _derived[key]
+                base = self(globals()[base])
+                self._results[key] = base.groupby(np.array([value_func(v) for v in base.index], dtype=object)).sum() \
+                                     if len(base) else func(self.series)
+            else:
+                self._results[key] = func(self.series)
+        return self._results[key]
+
 def _type_init(self):
     """Contains the type-specific cleansing, validation, transformation etc.
     ToDo: completely integrate in current type-system!!!"""
@@ -179,5 +271,35 @@ def test_cat():
         print cat
         print cat(s1).groupby(level=0).sum()
 
+def test_categorizer(count=100000, repeat=3):
+    """Compare the categorizer-engine with the cat-functions on the frequencies of count distinct values (names,
+    codes, addresses, some unicode). Print the time of both and assert that the results are identical."""
+    import time, random
+    random.seed(0)
+    alphabet = _LOWER + _UPPER + _DIGITS + _SPECIALS + '  #/()' + u'\xe9\xeb\xfc'
+    values = set()
+    while len(values) < count:
+        values.add(u''.join([random.choice(alphabet) for i in range(random.randint(0, 20))]))
+    values = [v.encode('ascii') if all([ord(c) < 128 for c in v]) else v for v in values]
+    values += ['a\x00c', u'ab\x00\xe9']  # The separator of the engine in a value
+    series = pd.Series([random.randint(1, 10) for v in values], values)
+    cats = (cat85, cat80, cat70, cat65, cat60, cat40, cat55, cat50, cat35, cat30, cat26, cat23, cat20, cat10)
+    start = time.time()
+    for i in range(repeat):
+        expected = [cat(series) for cat in cats]
+    print 'cat-functions: {:.2f}s'.format((time.time() - start) / repeat)
+    start = time.time()
+    for i in range(repeat):
+        categorizer = Categorizer(series)
+        found = [categorizer(cat) for cat in cats]
+    print 'Categorizer: {:.2f}s'.format((time.time() - start) / repeat)
+    for cat, e, f in zip(cats, expected, found):
+        assert e.equals(f), cat.func_name
+    # An empty series (e.g. an empty or all-NaN column), and only values with the separator:
+    for series in (pd.Series([]), pd.Series([1, 2], ['a\x00c', 'b'])):
+        categorizer = Categorizer(series)
+        for cat in cats:
+            assert cat(series).equals(categorizer(cat)), cat.func_name
+
 if __name__ == '__main__':
     test_cat()
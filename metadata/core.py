@@ -1,11 +1,12 @@
 # mapping.py - find, save and map attributes from a dataframe.
 from __future__ import division
 import pandas as pd, numpy as np
-import re, copy, collections, hashlib, json
+import re, copy, collections, hashlib, json, time, multiprocessing, threading, atexit
 from isounidecode import unidecode
 from biz.metadata.types import Types
 from os.path import join, split, splitext, splitdrive, isdir, isfile, exists
 from biz.pandas.tools.container import PrimusInterPares
+from biz.pandas.core.utils import FileLock, replace_file
 
 def clean_names(names):
     """Replace all names with names which can be used as property names,
@@ -34,12 +35,69 @@ def clean_names(names):
             result.insert(0, name)
     return pd.Series(result, name=names.name, index=names.index)
 
+def match_row(series):
+    """Return the metadata-row of the series: the best fitting type (see Types.matches), the alternatives and a
+    sample of the values. A module-level function, so it can be run in the worker-processes of match_rows."""
+    matches = Metadata.types.matches(series)
+    # and store the found data:
+    if matches:
+        match = matches[0]
+        row = pd.Series({'name_auto': match.type.property_name, 'type_auto': match.type.name, 
+                         'match': match.match.to_json(), 'match_mean': match.match.mean(), 
+                         'alternative_type_auto': ','.join([m.type.name for m in matches[1:]])})
+    else:
+        row = pd.Series({'name':'', 'type': '', 'name_auto': '', 'type_auto': '',
+                         'match': '', 'match_mean': '', 'alternative_type_auto': ''})
+    row['column_name'] = series.name
+    row['sample_values'] = ','.join(['{} ({})'.format(*i) for i in series.dropna().value_counts()[:5].iteritems()])
+    row['name_manual'] = ''
+    row['type_manual'] = ''
+    return row
+
+def match_worker_init():
+    "Initializer of the worker-processes of match_rows: load the types and the frequencies of their corpora once."
+    Metadata.types.load_frequencies()
+
+_match_pool = [None, 0]  # The pool of match_rows and its number of workers
+_match_pool_lock = threading.Lock()
+
+def match_pool(workers):
+    """Return the process-pool of match_rows with the number of workers, created on first use and kept for the next
+    calls, so the workers load the corpora only once. The frequencies of the corpora are loaded in this process 
+    first, so outdated frequencies are regenerated once and not by every worker."""
+    with _match_pool_lock:
+        if _match_pool[0] is None or _match_pool[1] != workers:
+            match_pool_close()
+            Metadata.types.load_frequencies()
+            _match_pool[:] = multiprocessing.Pool(workers, match_worker_init), workers
+        return _match_pool[0]
+
+@atexit.register
+def match_pool_close():
+    "Close the process-pool of match_rows, if any."
+    pool = _match_pool[0]
+    _match_pool[:] = None, 0
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+def match_rows(columns, workers=None):
+    """Return the rows (see match_row) of the columns (a list of series), in the order of the columns. With workers
+    (> 1) the columns are matched in parallel by the process-pool, see match_pool. A worker-process of a pool 
+    (e.g. of read_source) can't start processes, so it matches the columns one by one."""
+    workers = workers or 1
+    if workers < 2 or len(columns) < 2 or multiprocessing.current_process().daemon:
+        return [match_row(series) for series in columns]
+    return match_pool(workers).map(match_row, columns, chunksize=1)
+
 class Metadata(PrimusInterPares):
     """Store all possible information about the dataframe. Map columns to best matching type."""
     types = Types()   # Types is instantiated on the class-level, so is only instantiated once!
+    workers = None  # The number of worker-processes for matching new columns, see match_rows
     def __init__(self, levels=None, data_root=None, filename='metadata.csv', default_extension='.csv'):
         super(Metadata, self).__init__()
         self._levels = self._data_root = self._default_extension = self._filename = None
+        self.column_hashes = {}  # The hashes per column of the last map, see columns_hash
         self.set(levels, data_root, filename, default_extension)
     def copy(self):
         return copy.copy(self)
@@ -66,10 +124,26 @@ class Metadata(PrimusInterPares):
             filename += self._default_extension
         self._filename = join(self._data_root, join(*self._levels), filename)
         self.add(self)
+        self._data = self._read()
+    def _read(self):
+        """Return the data of the metadata-file. It is read without the lock-file, which needs write-access (e.g. not
+        on a read-only share), for save replaces it by a completely written file."""
         if exists(self._filename):
-            self._data = pd.read_csv(self._filename, sep=';', encoding='cp1252')
-        else:
-            self._data = pd.DataFrame()
+            return pd.read_csv(self._filename, sep=';', encoding='cp1252')
+        return pd.DataFrame()
+    def save(self, matches):
+        """Save the matches in the metadata-file, with the rows of the other columns in the file. Safe for any number 
+        of threads and processes saving the same file (e.g. the workers of read_source for the files of one slice): 
+        under the lock-file {filename}.lock the file is read again, so the columns saved by the others are kept, and
+        it is replaced by a completely written file."""
+        with FileLock.get(self._filename + '.lock'):
+            self._data = self._read()
+            cond = ~self._data.column_name.isin(matches.column_name) if 'column_name' in self._data and 'column_name' in matches else slice(0, None)
+            self._data = pd.concat([matches, self._data[cond]])
+            filename_tmp = self._filename + '.tmp'
+            self._data.to_csv(filename_tmp, sep=';', encoding='cp1252', index=False,
+                              cols='column_name column_name_new name type name_auto type_auto match match_mean sample_values alternative_type_auto name_manual type_manual'.split())
+            replace_file(filename_tmp, self._filename)
     def function_hash(self, function_name='convert'):
         """Return a hash based on the code of all present functions. All specified types are looked up
         in the type-specification and the code of the specified function is hashed. Finally, all hashes 
@@ -87,55 +161,57 @@ class Metadata(PrimusInterPares):
                         cats += json.loads(m).keys()
                     result.update(t.categorizer_hash(max(cats)))
         return result.hexdigest()
-    def map(self, df, make_unique=True, clean=True, normalize=True, inplace=True):
-        """Replace the column names with standard names based on the type of the value.
-        The type is inferred from the type-selection mechanism. If multiple columns with the
-        same type exist and make_unique=True, the standard names are suffixed with the
-        original name of the attribute, ."""
-        from biz.pandas import clean_column_names
+    def columns_hash(self, matches, function_name='convert'):
+        """Return a hash per column (by original column name) of everything which determines the mapped column: 
+        the original and new name, the type and the code of its convert-function and categorizers."""
+        result = {}
+        for i in range(len(matches)):
+            row = matches.iloc[i]
+            typename = row.get('type')
+            h = hashlib.md5(json.dumps([unicode(row.get(k)) for k in ('column_name', 'column_name_new', 'type')]))
+            if isinstance(typename, basestring) and typename in self.types:
+                t = self.types[typename]
+                h.update(t.function_hash(function_name))
+                try:
+                    cats = json.loads(row.get('match')).keys()
+                except (TypeError, ValueError, AttributeError):
+                    cats = []
+                if cats:
+                    h.update(t.categorizer_hash(max(cats)))
+            result[unicode(row.get('column_name'))] = h.hexdigest()
+        return result
+    def match(self, df, workers=None):
+        """Return the matches of the columns of the dataframe: a row per column with the best fitting type and the 
+        new column name. Known columns are taken from the metadata, the others are matched by their values (see
+        Types.matches), by workers processes (default the class-attribute workers, see match_rows). 
+        Changes are saved in the metadata-file."""
         def columns_match(df):
             "Do a match for best fitting type for every contained column."
             self._dirty = False
-            def column_match(series):
-                """Comparison of supplied series with available types. If not found, do a match and add to metadata.
-                If found, do a quick check of the type."""
-                def match_row(series):
-                    matches = self.types.matches(series)
-                    # and store the found data:
-                    if matches:
-                        match = matches[0]
-                        row = pd.Series({'name_auto': match.type.property_name, 'type_auto': match.type.name, 
-                                         'match': match.match.to_json(), 'match_mean': match.match.mean(), 
-                                         'alternative_type_auto': ','.join([m.type.name for m in matches[1:]])})
-                    else:
-                        row = pd.Series({'name':'', 'type': '', 'name_auto': '', 'type_auto': '',
-                                         'match': '', 'match_mean': '', 'alternative_type_auto': ''})
-                    row['column_name'] = column_name
-                    row['sample_values'] = ','.join(['{} ({})'.format(*i) for i in series.dropna().value_counts()[:5].iteritems()])
-                    row['name_manual'] = ''
-                    row['type_manual'] = ''
-                    self._dirty = True
-                    return row
+            def column_row(series):
+                """Return the row of the supplied series from the metadata, after a quick check of the type. 
+                If not found or the check fails, return None so a match is done."""
                 column_name = series.name
                 # ToDo: check if column name is in _data!!!!
                 row = pd.Series(self._data[self._data.column_name == column_name].iloc[0]) \
                     if 'column_name' in self._data and (self._data.column_name == column_name).any() \
                     else pd.Series()
-                if not row.empty:
-                    # Found, get data and do a check:
-                    # Set auto-name if manual type specified
-                    # ToDo: manualoverride of str-type does not work yet
-                    type_manual = row.dropna().get('type_manual')
-                    if type_manual and type_manual in self.types and row['name_auto'] != self.types[type_manual].property_name:
-                        row['name_auto'] = self.types[type_manual].property_name
-                        #self._dirty = True
-                    elif row.get('type') and row.get('type') is not np.nan and not self.types.verify(row.get('type'), series):
-                        row = match_row(series)
-                    # ToDo, save the corpus in an appropriate place if new type specified.
-                else:
+                if row.empty:
                     # Not found, do a match:
-                    row = match_row(series)
-                # Compute the definitive type and typename:
+                    return None
+                # Found, get data and do a check:
+                # Set auto-name if manual type specified
+                # ToDo: manualoverride of str-type does not work yet
+                type_manual = row.dropna().get('type_manual')
+                if type_manual and type_manual in self.types and row['name_auto'] != self.types[type_manual].property_name:
+                    row['name_auto'] = self.types[type_manual].property_name
+                    #self._dirty = True
+                elif row.get('type') and row.get('type') is not np.nan and not self.types.verify(row.get('type'), series):
+                    return None
+                # ToDo, save the corpus in an appropriate place if new type specified.
+                return row
+            def column_type(row):
+                "Compute the definitive type and typename of the row."
                 row['name'] = ''
                 row['type'] = ''
                 for key, keys in (('name', ['name_manual', 'name_auto']),
@@ -146,11 +222,16 @@ class Metadata(PrimusInterPares):
                                 row[key] = row[k]
                                 break
                 return row
-            result = pd.DataFrame([column_match(df.icol(i)) for i in range(df.shape[1])])
+            columns = [df.icol(i) for i in range(df.shape[1])]
+            rows = [column_row(series) for series in columns]
+            # Match the new columns, in parallel if workers are given; the rows keep the order of the columns:
+            unmatched = [i for i, row in enumerate(rows) if row is None]
+            for i, row in zip(unmatched, match_rows([columns[i] for i in unmatched], workers or self.workers)):
+                rows[i] = row
+                self._dirty = True
+            result = pd.DataFrame([column_type(row) for row in rows])
             # Save the data if necessary:
             return result
-        # ToDo: map all columns, set the new names for the columns, convert the data types.
-        if not inplace: df = df.copy()
         matches = columns_match(df)
         # Get the previous column_name_new, if any, for comparison with new column names:
         names_new = matches.column_name_new if 'column_name_new' in matches else pd.Series()
@@ -165,20 +246,64 @@ class Metadata(PrimusInterPares):
         matches['column_name_new'] = clean_names(matches.column_name_new)
         # Save the complete data, so including unused columns:
         if self._dirty or (len(names_new) != len(matches.column_name_new)) or (names_new != matches.column_name_new).any():
-            cond = ~self._data.column_name.isin(matches.column_name) if 'column_name' in self._data and 'column_name' in matches else slice(0, None)
-            self._data = pd.concat([matches, self._data[cond]])
-            self._data.to_csv(self._filename, cols='column_name column_name_new name type name_auto type_auto match match_mean sample_values alternative_type_auto name_manual type_manual'.split())
+            self.save(matches)
             self._dirty = False
+        return matches
+    def map(self, df, make_unique=True, clean=True, normalize=True, inplace=True, previous=None, matches=None):
+        """Replace the column names with standard names based on the type of the value.
+        The type is inferred from the type-selection mechanism. If multiple columns with the
+        same type exist and make_unique=True, the standard names are suffixed with the
+        original name of the attribute, .
+        The matches (see match) can be given, e.g. found once on a sample when a large file is mapped in chunks,
+        so every chunk gets the same types and names.
+        The previous (mapped dataframe, attrs) is an outdated result of the same data, e.g. after a change of the
+        metadata or of a convert-function: its columns with an unchanged hash (see columns_hash) are reused 
+        instead of converted again. The hashes are kept in column_hashes, for storing them with the result."""
+        # ToDo: map all columns, set the new names for the columns, convert the data types.
+        if not inplace: df = df.copy()
+        if matches is None:
+            matches = self.match(df)
         # Now construct a dataframe with the new columns: converted if appropriate, otherwise the original column.
         # Make a new dataframe because in-datafraame changes clash with the current type of the column.
         # Use an ordereddict to preserve order of columns:
         new_columns = collections.OrderedDict()
+        self.column_hashes = self.columns_hash(matches)
+        previous_df, previous_attrs = previous if previous else (None, {})
+        previous_hashes = (previous_attrs or {}).get('column_hashes', {})
+        if previous_df is not None and not previous_df.index.equals(df.index):
+            previous_df = None
         for i, name in zip(range(df.shape[1]), matches.column_name_new.values):
+            hash = self.column_hashes[unicode(matches.iloc[i]['column_name'])]
+            if previous_df is not None and previous_hashes.get(unicode(matches.iloc[i]['column_name'])) == hash and \
+               name in previous_df.columns:
+                new_columns[name] = previous_df[name]
+                continue
             t = matches.iloc[i]['type']            
             convert = self.types[t].convert if t in self.types and hasattr(self.types[t], 'convert') else None
             new_columns[name] = df.iloc[:,i].apply(convert) if convert else df.iloc[:,i]
         # Add metadata to the newly constructed dataframe:
         return pd.DataFrame(new_columns).assume_metadata(df)
 
+def test_match_workers(filename, workers=(1, 8, 16), nrows=10000, **kwargs):
+    """Match all columns of the file serially and with the numbers of workers; print the time and speedup of each
+    and whether the rows are identical to the rows of the first run. The frequencies are loaded and the pools are 
+    started before timing. Skipped when the file or the corpora of the types are not present."""
+    import biz.pandas as bp
+    if not exists(filename) or not any([t.corpus for t in Metadata.types]):
+        print 'Skipped: no file "{}" or no corpora in "{}"'.format(filename, Metadata.types.root_data)
+        return None
+    df = bp.read_file(filename, nrows=nrows, **kwargs)
+    columns = [df.icol(i) for i in range(df.shape[1])]
+    Metadata.types.load_frequencies()
+    results = {}
+    for n in workers:
+        if n > 1: match_pool(n)
+        start = time.time()
+        rows = pd.DataFrame(match_rows(columns, n))
+        results[n] = time.time() - start, rows
+        print '{} workers: {} columns in {:.1f}s, speedup {:.1f}x, identical: {}'.format(
+            n, len(columns), results[n][0], results[workers[0]][0] / results[n][0], rows.equals(results[workers[0]][1]))
+    return results
+
 if __name__ == '__main__':
     pass
\ No newline at end of file
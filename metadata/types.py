@@ -6,6 +6,8 @@ import sys, os, re, importlib, hashlib, itertools, math, collections
 from os.path import join, split, splitext, exists
 import pandas as pd, numpy as np
 from biz.basetypes.str import *  # Temporary solution for string-only categorizers
+from biz.pandas.io import columnar
+from biz.pandas.core.utils import FileLock
 
 CAT_PAT = 'cat(\d+)'
 DEFAULT_CAT = 'cat99'
@@ -35,11 +37,164 @@ def chi_square(series1, series2):
         # No valid 
         return 1
 
+def chi_square_batch(sample, corpora):
+    """Return the relative chi-squares of the sample against each of the corpora as an array: the same as 
+    [chi_square(corpus, sample) for corpus in corpora], but computed at once. The frequencies are summed per category 
+    on a shared vocabulary into a dense matrix, a row per series; categories NaN and '' are dropped, as in chi_square.
+    A corpus without valid frequencies gets 1."""
+    frames = [sample] + list(corpora)
+    lengths = np.array([len(s) for s in frames])
+    rows = np.repeat(np.arange(len(frames)), lengths)
+    counts = np.concatenate([np.asarray(s.values, dtype=float) for s in frames] + [np.empty(0)])
+    counts[np.isnan(counts)] = 0
+    # Scale the corpora to the total of the sample, including the dropped categories:
+    totals = np.bincount(rows, counts, len(frames))
+    keys = np.concatenate([np.asarray(s.index, dtype=object) for s in frames] + [np.empty(0, dtype=object)])
+    codes, vocabulary = pd.factorize(keys)
+    vocabulary = np.asarray(vocabulary, dtype=object)
+    valid = (codes >= 0) & (vocabulary.take(codes) != '' if len(vocabulary) else np.ones(len(codes), dtype=bool))
+    size = len(vocabulary)
+    matrix = np.bincount(rows[valid] * size + codes[valid], counts[valid], len(frames) * size).reshape(len(frames), size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaled = matrix[1:] * (totals[0] / totals[1:])[:, None]
+        delta = ((scaled - matrix[0]) ** 2).sum(axis=1)
+        maxi = (np.maximum(scaled, matrix[0]) ** 2).sum(axis=1)
+        result = delta / maxi
+    result[~np.isfinite(result)] = 1
+    return result
+
+def sample_chi_squares(sample, corpora):
+    """Return the relative chi-squares of the categorized sample against each of the corpora, as compared by 
+    Type.match: the NaN-categories of the sample are dropped before its total is taken, the categories '' are not."""
+    return chi_square_batch(sample[pd.notnull(np.asarray(sample.index, dtype=object))], corpora)
+
+class CorpusIndex(object):
+    """The frequencies of all categories of all corpora of the types, compiled into one columnar file (see 
+    Types.build_index and biz.pandas.io.columnar): the values of all frequencies in one strings-column, so every
+    value is stored once and referred to by its id, and the counts in one array. Per category the header has its
+    rows and the checksum of its categorizer, per corpus the modification times of its files and the checksums and 
+    significances of the corpus-files, so these don't have to be read.
+    Opening the index reads only the header; the rows of a category are read when the category is used. A corpus 
+    of which a file changed after the build, or a category of which the categorizer changed, is not used and loaded
+    from the corpus-files instead.
+    The file may be replaced by a build of another Types-object or process: then the header is read again before
+    it is used (see refresh), and rows which are read while the file is replaced are read again."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.load()
+    def _stat(self):
+        "Return the file-attributes of the index which change when it is replaced, or None when it is missing."
+        try:
+            s = os.stat(self.filename)
+        except OSError:
+            return None
+        return s.st_ino, s.st_size, s.st_mtime
+    def load(self):
+        "Read the header of the index."
+        self.header = None
+        self.corpora = {}  # Key (type|corpus): {stamps, normalize, functions, significance}
+        self.entries = {}  # Key (type|corpus|category): {rows, checksum}
+        self.stat = self._stat()
+        if self.stat is not None:
+            try:
+                self.header = columnar.read_header(self.filename)
+                self.corpora = self.header['attrs']['corpora']
+                self.entries = self.header['attrs']['entries']
+            except (IOError, ValueError, KeyError) as e:
+                print e  # Corrupt index, build it again
+    def refresh(self):
+        "Read the header again when the file is replaced since it was read."
+        if self._stat() != self.stat:
+            self.load()
+    @staticmethod
+    def key(*names):
+        return '|'.join(names)
+    @staticmethod
+    def stamps(corpus):
+        "Return the modification times of the files of the corpus, None for a missing file."
+        result = []
+        for name in (corpus.file_corpus, corpus.file_cat.format(DEFAULT_CAT), corpus.file_cat.format('functions'), 
+                     corpus.file_cat.format('significance')):
+            try:
+                result.append(os.path.getmtime(join(corpus.path, name)))
+            except OSError:
+                result.append(None)
+        return result
+    @staticmethod
+    def normalize_checksum(corpus):
+        return corpus.function_names(corpus.typ.normalize)[1] if hasattr(corpus.typ, 'normalize') else None
+    def valid(self, corpus):
+        "Return whether the index is valid for the corpus: none of its files and its normalize-function changed."
+        self.refresh()
+        entry = self.corpora.get(self.key(corpus.typ.name, corpus.name))
+        return entry is not None and entry['stamps'] == self.stamps(corpus) and \
+               entry['normalize'] == self.normalize_checksum(corpus)
+    def frequencies(self, corpus, name):
+        "Return the frequencies of the category of the corpus, or None if the category is not (validly) indexed."
+        while True:
+            self.refresh()
+            entry = self.entries.get(self.key(corpus.typ.name, corpus.name, name))
+            if entry is None or entry['checksum'] != corpus.function_names(corpus.categorizers[name])[1]:
+                return None
+            start, stop = entry['rows']
+            try:
+                counts = np.array(columnar.read_column(self.filename, 'count', start, stop, self.header))
+                values = columnar.read_column(self.filename, 'value', start, stop, self.header)
+            except (IOError, ValueError, KeyError):
+                if self._stat() == self.stat: raise
+                continue  # Replaced while reading
+            if self._stat() == self.stat:
+                return pd.Series(counts, values)
+    def function_checksums(self, corpus):
+        "Return the function-checksums of the corpus, as read by Corpus.function_changed."
+        checksums = self.corpora[self.key(corpus.typ.name, corpus.name)]['functions']
+        if checksums is None:
+            raise IOError('No functions-file for corpus "{}"'.format(corpus.path))
+        return pd.DataFrame({'checksum': checksums.values()}, pd.Index(checksums.keys(), name='function'))
+    def significances(self, corpus):
+        "Return the significances of the corpus, as read by Corpus.significance_get."
+        rows = self.corpora[self.key(corpus.typ.name, corpus.name)]['significance']
+        if not rows:
+            return pd.DataFrame()
+        return pd.DataFrame([[long(r[2])] for r in rows], pd.MultiIndex.from_tuples([tuple(r[:2]) for r in rows], 
+                            names=('category', 'significance')), columns=['count'])
+    @classmethod
+    def build(cls, filename, corpora, index=None):
+        """Write the index of the corpora (per type and corpus name) to the file. The categories are loaded by the 
+        corpora, from the current index (if valid) or else from (and regenerated in) the corpus-files."""
+        values, counts = [], []
+        attrs = {'corpora': {}, 'entries': {}}
+        position = 0
+        for corpus in corpora:
+            for name in sorted(corpus.categorizers.keys()):
+                frequencies = corpus[name]
+                attrs['entries'][cls.key(corpus.typ.name, corpus.name, name)] = {
+                    'rows': [position, position + len(frequencies)], 
+                    'checksum': corpus.function_names(corpus.categorizers[name])[1]}
+                values.append(np.asarray(frequencies.index, dtype=object))
+                counts.append(np.asarray(frequencies.values, dtype=np.int64))
+                position += len(frequencies)
+            # The files are up-to-date after loading the categories:
+            filename_functions = join(corpus.path, corpus.file_cat.format('functions'))
+            functions = pd.read_csv(filename_functions, sep=';', header=0, index_col='function')['checksum'] \
+                        if exists(filename_functions) else None
+            significances = corpus.significance_get()[1]
+            attrs['corpora'][cls.key(corpus.typ.name, corpus.name)] = {
+                'stamps': cls.stamps(corpus), 'normalize': cls.normalize_checksum(corpus),
+                'functions': functions.to_dict() if functions is not None else None,
+                'significance': [list(k) + [int(v)] for k, v in significances['count'].iteritems()] if len(significances) else []}
+        df = pd.DataFrame({'value': np.concatenate(values) if values else np.empty(0, dtype=object),
+                           'count': np.concatenate(counts) if counts else np.empty(0, dtype=np.int64)}, columns=['value', 'count'])
+        with FileLock.get(filename + '.lock'):
+            columnar.write_frame(filename, df, attrs)
+        return cls(filename)
+
 class Corpus(object):
     """Contains the data for a corpus, including all categorized versions. The data of a specific category can be 
     retrieved by specifying the category as an index: corpus['cat10']
-    The values of the category are cached in """
-    def __init__(self, path, typ, categorizers={}, file_corpus='corpus.txt', file_cat='corpus.{}.csv', significance=.9):
+    The values of the category are cached in frequencies, and read from the index (see CorpusIndex) if valid."""
+    def __init__(self, path, typ, categorizers={}, file_corpus='corpus.txt', file_cat='corpus.{}.csv', significance=.9, 
+                 index=None):
         self.path = path
         self.name = split(path)[-1]
         self.typ = typ
@@ -51,6 +206,19 @@ class Corpus(object):
         self._significances = None
         self._function_checksums = None
         self.data = None
+        self._categorizer = None  # The categorizer-engine on the data, see Categorizer
+        self.index = index
+        self._indexed = None  # Whether the index is valid for this corpus, see indexed
+    def indexed(self):
+        "Return whether the index is valid for this corpus; not after a file of the corpus is written."
+        if self._indexed is None:
+            self._indexed = self.index is not None and self.index.valid(self)
+        return self._indexed
+    def refresh(self):
+        "Forget the loaded frequencies and files, so they are loaded again from the index or the corpus-files."
+        self.frequencies = {}
+        self.data = None
+        self._significances = self._function_checksums = self._indexed = None
     def function_names(self, func):
         h = hashlib.md5(func.func_code.co_code)
         if func.func_doc:
@@ -61,6 +229,8 @@ class Corpus(object):
         return name, h.hexdigest(), filename
     def significance_get(self):
         filename = join(self.path, self.file_cat.format('significance'))
+        if self.indexed():
+            return filename, self.index.significances(self)
         return filename, \
                pd.read_csv(filename, sep=';', header=0, index_col=(0,1), dtype={'count': long}) \
                if exists(filename) else pd.DataFrame()
@@ -94,12 +264,14 @@ class Corpus(object):
         df1.to_csv(filename, sep=';', index=True)
         # Invalidate the cache:
         self._significances = None
+        self._indexed = False
     def function_changed(self, func):
         "Compare the code of the supplied function with the stored function. Return False if same, True if different."
         name, checksum, filename = self.function_names(func)
         try:
             if self._function_checksums is None:
-                self._function_checksums = pd.read_csv(filename, sep=';', header=0, index_col='function')
+                self._function_checksums = self.index.function_checksums(self) if self.indexed() else \
+                                           pd.read_csv(filename, sep=';', header=0, index_col='function')
                 print ',',
             return self._function_checksums.ix[name]['checksum'] != checksum
         except:
@@ -115,7 +287,12 @@ class Corpus(object):
         pd.DataFrame([checksum], pd.Index([name], name='function'), ['checksum']).combine_first(df).to_csv(filename, sep=';', index=True)
         # Invalidate the cache:
         self._function_checksums = None
+        self._indexed = False
     def __getitem__(self, name):
+        if name not in self.frequencies and self.indexed():
+            frequencies = self.index.frequencies(self, name)
+            if frequencies is not None:
+                self.frequencies[name] = frequencies
         if name not in self.frequencies:
             # Frequencies not filled, try to get the filename:
             filename = join(self.path, self.file_cat.format(name))
@@ -167,7 +344,9 @@ class Corpus(object):
                     # Remove NaN from index:
                     index_dropna(self.data)
                 # The data is present; categorize it and write to file:
-                s2 = index_dropna(func(self.data), inplace=False)
+                if self._categorizer is None or self._categorizer.series is not self.data:
+                    self._categorizer = Categorizer(self.data)
+                s2 = index_dropna(self._categorizer(func), inplace=False)
                 #s3 = s2.groupby(level=0).sum()
                 #s3.sort(ascending=False)
                 #s3.to_csv(filename, sep=';', header=['count'], index_label=['value'], index=True)
@@ -257,6 +436,27 @@ def validate_arg(f, validate):
             return np.nan
     return robustify(f, wrapped)
 
+def _code_names(code):
+    "Return the names used by the code and by the code of the functions defined in it."
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_names'):
+            names |= _code_names(const)
+    return names
+
+def function_key(f):
+    """Return a hash of the function which is equal for functions which compute the same: the code, constants, 
+    names, defaults, docstring and the globals which the code uses, by value for a str or number and by identity
+    otherwise (e.g. a compiled pattern of the module). A function with a closure is identified by itself, for its 
+    cells may differ."""
+    if f is None or getattr(f, 'func_closure', None) or not hasattr(f, 'func_code'):
+        return f
+    code = f.func_code
+    values = [(name, f.func_globals[name]) for name in sorted(_code_names(code)) if name in f.func_globals]
+    values = [(name, repr(value) if isinstance(value, (basestring, int, long, float, bool)) or value is None else id(value))
+              for name, value in values]
+    return hashlib.md5(repr((code.co_code, code.co_consts, code.co_names, f.func_defaults, f.func_doc, values))).hexdigest()
+
 class Type(object):
     "A datatype with pointers to their possible converters, full data source and sample data sources."
     def __init__(self, name, root_module):
@@ -305,10 +505,14 @@ class Type(object):
         return h.hexdigest()
     def add_corpus(self, corpus):
         self.corpus[corpus.name] = corpus
-    def match(self, series, cat_min=0, cat_max=30, sample_count=None, samples_per_bin=None, previous_match=pd.Series()):
+    def match(self, series, cat_min=0, cat_max=30, sample_count=None, samples_per_bin=None, previous_match=pd.Series(), 
+              categorizers=None):
         """Return a series with the matches of each category. When a sample count of None is given, 
         the sample count is inferred from the distribution of the target, the number of bins in the 
-        target is multiplied by the number of samples per bin."""
+        target is multiplied by the number of samples per bin.
+        The categorizers is a dict for sharing the categorized sample between the types matched on the same series,
+        e.g. in Types.matches: the sample is normalized and categorized once per distinct normalize-function (see 
+        function_key), the categorizers of this module once in total per normalized sample, see Categorizer."""
         def sample_get(count):
             count = count or 1
             i = int(len(series.dropna()) / count) or 1
@@ -325,14 +529,20 @@ class Type(object):
             # If the reference has fewer items, lower the number in the sample:
             if c[cat].sum() < count: count = c[cat].sum()
             sample = sample_get(count)
-        sample1 = sample.apply(self.normalize) if hasattr(self, 'normalize') else sample
+        # The sample depends on the corpus with samples_per_bin, so it is shared only without:
+        key = (id(series), sample_count, function_key(getattr(self, 'normalize', None))) if not samples_per_bin else None
+        if categorizers is not None and key in categorizers:
+            categorizer = categorizers[key][1]
+        else:
+            sample1 = sample.apply(self.normalize) if hasattr(self, 'normalize') else sample
+            categorizer = Categorizer(sample1.groupby(sample1.values).size())
+            if categorizers is not None and key is not None:
+                categorizers[key] = series, categorizer  # Keep the series, so its id is not reused
         for cat in sorted(self.categorizers.keys()):
             if not cat_min <= int(re.match(CAT_PAT, cat).group(1)) < cat_max:
                 continue
-            sample2 = self.categorizers[cat](sample1.groupby(sample1.values).size())
-            index_dropna(sample2)
-            sample3 = sample2.groupby(level=0).sum()
-            result[cat] = min([chi_square(c[cat], sample3) for c in self.corpus.values()] or [1])  # Empty sequence: chi = 1
+            chis = sample_chi_squares(categorizer(self.categorizers[cat]), [c[cat] for c in self.corpus.values()])
+            result[cat] = chis.min() if len(chis) else 1  # No corpus: chi = 1
         return previous_match.append(pd.Series(result))
     @property
     def property_name(self):
@@ -365,15 +575,18 @@ def null(*args, **kwargs): pass
 
 class Types(object):
     """All available types with pointers to their converters, """
-    def __init__(self, root_data=r"P:\data\types", root_module="biz.types"):
+    def __init__(self, root_data=r"P:\data\types", root_module="biz.types", file_index='corpus.index'):
         self.root_data = root_data
         self.root_module = root_module
+        self.file_index = file_index
         self.types = {}
+        self.index = None
     def _load(self):
         """Load the types, based on two locations:
         - corpus- and categorization-data in the data-root
         - class-information in the root of the type and below.
-        The information of both sources is combined;a type can be present in any or both of these sources."""
+        The information of both sources is combined;a type can be present in any or both of these sources.
+        The frequencies of the corpora are read from the index in the data-root if valid, see build_index."""
         def type_module(path, sys_root):
             """Return the modulename and module  belonging to the specified path if it is a valid type-module. 
             If not, return (None, None)."""
@@ -389,6 +602,7 @@ class Types(object):
             if hasattr(mod, 'pattern') and isinstance(mod.pattern, basestring):
                 return shortname, mod
             return no_mod
+        self.index = CorpusIndex(join(self.root_data, self.file_index))
         for dirpath, dirnames, filenames in os.walk(self.root_data):
             # All subdirectories in this directory contain types. A type is present if a subdir (source name) 
             # exists with a file names corpus.*.txt.
@@ -397,7 +611,7 @@ class Types(object):
                 # parent directory then must be a typename:
                 name = dotted(split(dirpath)[0], self.root_data)
                 typ = self.types.setdefault(name, Type(name, self.root_module))
-                typ.add_corpus(Corpus(dirpath, typ, typ.categorizers))
+                typ.add_corpus(Corpus(dirpath, typ, typ.categorizers, index=self.index))
         # Now get all modules from the type-root, which were not imported by getting the corpus-files:
         mod = importlib.import_module(self.root_module)
         for p_mod in mod.__path__:
@@ -412,10 +626,11 @@ class Types(object):
                         self.types.setdefault(mod_name, Type(mod_name, self.root_module))
         # Data is loaded. Don't load again when called, so replace _load function with stub:
         self.__class__._load = null
-    def matches(self, series):
+    def matches(self, series, share=True):
         """Return all possible matches and their match with the target. The match is the relative chi-square, 
         so 0 is total match and 1 is total difference.
-        The matches are returned as a list of TypeMatch-tuples: a type and the found match of the type."""
+        The matches are returned as a list of TypeMatch-tuples: a type and the found match of the type.
+        With share, the categorized samples are computed once for all types, see Type.match."""
         self._load()
         def filtered(matches, min_threshold=None, min_match_fraction=None):
             "Accept a list of tuples: Type and chi-squares per category. Return a list of possible types and their matches."
@@ -447,28 +662,53 @@ class Types(object):
         # Execute a funnel of selections, the first three steps on a fixed sample (sampling is a relatively expensive process)
         # Take 47 because it is a prime, with approx 7 bins with each 7 values, assuming a small number of bins and high discrimination
         sample = series.dropna()[::int(len(series.dropna()) / 47) or 1][:47]
+        # The categorized samples, shared by the types with the same normalize-function (see Type.match):
+        categorizers = {} if share else None
         # First establish the base type of the values (string, int, float, datetime, bool). 
         # Only a string can be upcast to a more specific type, if a type is already specific, 
         # no further conversion is done.
         basetype = None
         matches = []
         # Set the min threshold to .7 for the first categroies, because these are so basic that they MUST ALL conform.
-        matches.append(filtered([TypeMatch(typ, typ.match(sample, 0, 18)) for typ in self], .7, .95))  #; print len(matches[-1]), matches[-1]
+        matches.append(filtered([TypeMatch(typ, typ.match(sample, 0, 18, categorizers=categorizers)) for typ in self], .7, .95))  #; print len(matches[-1]), matches[-1]
         if len(matches[-1]) > 1:
-            matches.append(filtered([TypeMatch(tm.type, tm.type.match(sample, 18, 30, previous_match=tm.match)) for tm in matches[-1]]))  #; print len(matches[-1]), matches[-1]
+            matches.append(filtered([TypeMatch(tm.type, tm.type.match(sample, 18, 30, previous_match=tm.match, categorizers=categorizers)) for tm in matches[-1]]))  #; print len(matches[-1]), matches[-1]
         if len(matches[-1]) > 1:
-            matches.append(filtered([TypeMatch(tm.type, tm.type.match(sample, 30, 60, previous_match=tm.match)) for tm in matches[-1]]))  #; print len(matches[-1]), matches[-1]
+            matches.append(filtered([TypeMatch(tm.type, tm.type.match(sample, 30, 60, previous_match=tm.match, categorizers=categorizers)) for tm in matches[-1]]))  #; print len(matches[-1]), matches[-1]
         if len(matches[-1]) > 1:
             # Take a new, larger sample because the categorizers generally have a larger populatoin in these area,
             # take 347 because it is a prime with roughly 49 bins with 7 values.
             sample2 = series.dropna()[::int(len(series.dropna()) / 347) or 1][:347]
-            matches.append(filtered([TypeMatch(tm.type, tm.type.match(sample2, 60, 90, previous_match=tm.match)) for tm in matches[-1]]))  #; print len(matches[-1]), matches[-1]
+            matches.append(filtered([TypeMatch(tm.type, tm.type.match(sample2, 60, 90, previous_match=tm.match, categorizers=categorizers)) for tm in matches[-1]]))  #; print len(matches[-1]), matches[-1]
         # See if enough matches found; if any of the group-matches is none, don't do complete match.
         if len(matches[-1]) > 1:
             # Don't take a sample, but do complete comparison between all values (slooow!!)
-            matches.append(filtered([TypeMatch(tm.type, tm.type.match(series, 90, 99, previous_match=tm.match)) for tm in matches[-1]]))  # ; print len(matches[-1]),
+            matches.append(filtered([TypeMatch(tm.type, tm.type.match(series, 90, 99, previous_match=tm.match, categorizers=categorizers)) for tm in matches[-1]]))  # ; print len(matches[-1]),
         # Return the last filled matches, if any.
         return ([tm_list for tm_list in matches if tm_list] or [[]])[-1]
+    def build_index(self):
+        """Compile the frequencies of all categories of all corpora into the index-file in the data-root, see 
+        CorpusIndex. The valid entries are taken from the current index, only the stale entries are loaded from 
+        (and regenerated in) the corpus-files. Run it after corpora or categorizers changed; until then the changed 
+        corpora are read from their files. Return the number of reused and rebuilt corpora."""
+        self._load()
+        corpora = [c for t in self for c in t.corpus.values()]
+        for corpus in corpora:
+            corpus._indexed = None  # Check the files again
+            if not corpus.indexed():
+                corpus.refresh()
+        reused = len([c for c in corpora if c.indexed()])
+        self.index = CorpusIndex.build(join(self.root_data, self.file_index), corpora)
+        for corpus in corpora:
+            corpus.index, corpus._indexed = self.index, None
+        return reused, len(corpora) - reused
+    def load_frequencies(self):
+        """Load the frequencies of all categories of all corpora, which are otherwise loaded on first use. E.g. before
+        matching in worker-processes: loaded (and regenerated if outdated) once, instead of in every worker."""
+        for t in self:
+            for corpus in t.corpus.values():
+                for cat in sorted(t.categorizers.keys()):
+                    corpus[cat]
     def verify(self, typename, series):
         """Check if the specified typename still applies to the supplied series. Return bool.
         Developers note: this should NOT be more strict than first step in type-matching, or the 
@@ -512,6 +752,92 @@ def test_match_qb():
             #continue
         print col, t.matches(o2i[col])
 
+def test_matches_shared(filename=r"P:\data\source\kpn\swol_marketing\google\2010-03-23\s1119446a - batch 1 - 50 000 adressen_sbi2.csv", 
+                        nrows=10000):
+    "Match the types of all columns with and without sharing the categorized samples; print the times and differences."
+    import time, biz.pandas as bp
+    t = Types()
+    t._load()
+    df = bp.read_file(filename, encoding='cp1252', nrows=nrows)
+    seconds = {}
+    results = {}
+    for share in (False, True):
+        start = time.time()
+        results[share] = [t.matches(df[col], share=share) for col in df]
+        seconds[share] = time.time() - start
+        print 'Shared' if share else 'Not shared', '{:.2f}s'.format(seconds[share])
+    for col, separate, shared in zip(df.columns, results[False], results[True]):
+        if [tm.type.name for tm in separate] != [tm.type.name for tm in shared]:
+            print 'Different matches', col, separate, shared
+    print 'Speedup {:.1f}x'.format(seconds[False] / (seconds[True] or 1))
+
+def test_function_key():
+    "Check functions with the same code get the same key, unless the globals which they use differ."
+    code = 'import re\npattern = re.compile("[^0-9]")\ndef normalize(s):\n    return s.str.replace(pattern, "").str[:postcode_len]\n'
+    namespaces = [{'postcode_len': 4}, {'postcode_len': 4}, {'postcode_len': 6}]
+    for namespace in namespaces:
+        exec code in namespace
+    namespaces[1]['pattern'] = namespaces[0]['pattern']
+    keys = [function_key(namespace['normalize']) for namespace in namespaces]
+    assert keys[0] == keys[1] != keys[2], keys
+    namespaces[1]['pattern'] = re.compile('[^0-9 ]')
+    assert function_key(namespaces[0]['normalize']) != function_key(namespaces[1]['normalize'])
+
+def test_chi_square_batch(corpora=10, categories=2000, repeat=5):
+    """Compare chi_square_batch with chi_square on random frequencies, with NaN and '' categories and corpora with 
+    a partly overlapping vocabulary; print the largest difference and the time of both."""
+    import time
+    rs = np.random.RandomState(0)
+    def frequencies(n, offset):
+        index = ['v{}'.format(i) for i in np.unique(rs.randint(offset, offset + categories, n))] + [np.nan, '']
+        return pd.Series(rs.randint(1, 1000, len(index)), index)
+    sample = frequencies(categories // 4, 0)
+    series = [frequencies(categories, rs.randint(0, categories)) for i in range(corpora)] + [pd.Series([])]
+    start = time.time()
+    for i in range(repeat):
+        expected = np.array([chi_square(c, sample) for c in series])
+    seconds = time.time() - start
+    start = time.time()
+    for i in range(repeat):
+        found = chi_square_batch(sample, series)
+    seconds_batch = time.time() - start
+    expected[~np.isfinite(expected)] = 1
+    print 'Max difference {:.2e}; chi_square {:.3f}s, chi_square_batch {:.3f}s'.format(
+        np.abs(found - expected).max(), seconds, seconds_batch)
+    assert np.allclose(found, expected)
+
+def test_sample_chi_squares(corpora=10, categories=2000):
+    """Compare sample_chi_squares, as used by Type.match, with the computation per corpus which Type.match did 
+    before chi_square_batch, on a categorized sample with NaN- and ''-categories."""
+    rs = np.random.RandomState(1)
+    def frequencies(n, offset):
+        index = ['v{}'.format(i) for i in np.unique(rs.randint(offset, offset + categories, n))] + [np.nan, '']
+        return pd.Series(rs.randint(1, 1000, len(index)), index)
+    sample = frequencies(categories // 4, 0)
+    series = [frequencies(categories, rs.randint(0, categories)) for i in range(corpora)] + [pd.Series([])]
+    sample2 = sample.copy()
+    index_dropna(sample2)
+    sample3 = sample2.groupby(level=0).sum()
+    expected = np.array([chi_square(c, sample3) for c in series])
+    expected[~np.isfinite(expected)] = 1
+    found = sample_chi_squares(sample, series)
+    print 'Max difference {:.2e}'.format(np.abs(found - expected).max())
+    assert np.allclose(found, expected)
+
+def test_index(root_data=r"P:\data\types"):
+    "Build the index of the corpora, and print the time to load all frequencies with and without it."
+    import time
+    t = Types(root_data)
+    start = time.time()
+    print 'Reused, rebuilt corpora:', t.build_index(), '{:.1f}s'.format(time.time() - start)
+    for index in (None, t.index):
+        start = time.time()
+        for typ in t:
+            for name, corpus in typ.corpus.items():
+                typ.add_corpus(Corpus(corpus.path, typ, typ.categorizers, index=index))
+        t.load_frequencies()
+        print 'Index' if index else 'Files', '{:.2f}s'.format(time.time() - start)
+
 def test_cache():
     for t in Types():
         print t.name, '-'*60
@@ -3,10 +3,15 @@ from biz.metadata.types import Types
 from urllib import urlencode
 from datetime import date, datetime
 from dateutil.parser import parse
-from collections import defaultdict
+from collections import defaultdict, deque
 from functools import partial
-import os, re, sys, types, copy, hashlib
+import os, re, sys, types, copy, hashlib, threading, atexit, time, json, subprocess, tempfile, multiprocessing, logging, shutil
+from multiprocessing.pool import ThreadPool
+from contextlib import contextmanager
 from os.path import join, split, splitext, splitdrive, isdir, isfile, exists
+from biz.pandas.core.utils import replace_file, FileLock
+from biz.pandas.io import columnar
+log = logging.getLogger('cache')
 
 ###############################################################################
 # This module contains objects for retrieving data from sources. When data is retrieved
@@ -18,9 +23,45 @@ def mystat(filename):
     s = os.stat(filename)
     return "nt.stat_result(st_size={}L, st_mtime={}L, st_ctime={}L)".format(long(s.st_size), long(s.st_mtime), long(s.st_ctime))
 
+# Compression profiles for the h5-files of the cache: (complevel, complib). 'heavy' is the classic setting.
+# 'fast' is for intermediate steps which are overwritten frequently, like 'input'.
+compression_profiles = {'none': (0, None), 'fast': (1, 'blosc'), 'balanced': (5, 'blosc'), 'heavy': (9, 'blosc'), 'small': (9, 'bzip2')}
+compression_auto = ('heavy', 'balanced', 'fast', 'none')  # Candidates for 'auto', from heavy to light
+
+def compression_profile(compression, process_name=None):
+    """Return the name of the compression-profile. The compression is a profile-name or a dict with the 
+    profile by process name (pipeline-step) and an optional 'default'-profile: {'input': 'fast', 'default': 'heavy'}"""
+    if isinstance(compression, dict):
+        compression = compression.get(process_name, compression.get('default'))
+    return compression or 'heavy'
+
+def compression_choose(df, target, sample_rows=10000, samples=3):
+    """Return the heaviest compression-profile with a write-throughput of at least target MB/s, measured
+    by writing a few chunks of the dataframe to a temporary h5-file with every candidate profile."""
+    step = max(len(df) // samples, 1)
+    sample = pd.concat([pd.DataFrame(df.iloc[i:i + sample_rows]) for i in range(0, len(df), step)[:samples]]) if len(df) else pd.DataFrame(df)
+    size = None
+    result = compression_auto[-1]
+    for profile in reversed(compression_auto):
+        # From light to heavy; the uncompressed size is the reference for the throughput
+        handle, filename = tempfile.mkstemp('.h5')
+        os.close(handle)
+        try:
+            t0 = time.time()
+            with BizHDFStore(filename, 'w', *compression_profiles[profile]) as hdf:
+                hdf.put('sample', sample, format='table')
+            seconds = time.time() - t0
+            size = size or os.path.getsize(filename)
+        finally:
+            os.remove(filename)
+        if size / 2. ** 20 / max(seconds, 1e-6) < target:
+            break
+        result = profile
+    return result
+
 class BizHDFStore(pd.HDFStore):
-    def __init__(self, filename, mode=None):
-        super(BizHDFStore, self).__init__(filename, mode, 9, 'blosc', False)
+    def __init__(self, filename, mode=None, complevel=9, complib='blosc'):
+        super(BizHDFStore, self).__init__(filename, mode, complevel, complib, False)
         self._mode = mode
     def __enter__(self):
         return self
@@ -29,59 +70,900 @@ class BizHDFStore(pd.HDFStore):
         self.close()
         return True
 
+class StorePool(object):
+    """Process-wide pool of open cache-files. A file is opened lazily on first use and kept open, so repeated
+    lookups in one run never reopen the h5-file. Every use is reference counted and serialized per file, and all
+    use of pytables is serialized in the process (the hdf5-library is not thread-safe). A file which is not used 
+    for idle_timeout seconds is flushed and closed by a reaper-thread, all files still open are flushed and closed 
+    at exit of the process.
+    When the cache-files are shared with other processes (see share), every use is also serialized by the shared
+    lock and the file is closed after every use, so every process sees the writes of the others.
+    Using the files is safe for any number of processes, by the lock-file {filename}.lock: readers hold it shared,
+    a writer exclusively (see write), so a reader never sees a half-written file. A store which is open for reading 
+    is reopened when the file was replaced or changed by another process: when its inode, size or mtime changed, or
+    the generation in the lock-file, which every writer increases (see FileLock.bump)."""
+    shared_lock = None  # Lock shared with other processes, set by share
+    def __init__(self, idle_timeout=60):
+        self.idle_timeout = idle_timeout
+        self._lock = threading.RLock()
+        self._hdf_lock = threading.RLock()
+        self._entries = {}  # Absolute filename: [store, refcount, last_used, lock, depth, version at opening, write depth]
+        self._reaper = None
+        atexit.register(self.close_all)
+    def share(self, lock):
+        """Share the cache-files with other processes, which use the same (multiprocessing.RLock) lock. 
+        Used in the initializer of a process-pool."""
+        self.close_all()
+        self.shared_lock = lock
+    def _entry(self, name):
+        "Register the use of the file and return its entry, without waiting for any lock."
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = self._entries[name] = [None, 0, time.time(), threading.RLock(), 0, None, 0]
+            entry[1] += 1
+            return entry
+    def _enter(self, name):
+        "Register the use of the file and wait for the locks; return the entry."
+        entry = self._entry(name)
+        entry[3].acquire()
+        if self.shared_lock is not None: self.shared_lock.acquire()
+        self._hdf_lock.acquire()
+        entry[4] += 1
+        return entry
+    def acquire(self, filename, mode='r', complevel=9, complib='blosc'):
+        """Return an open store for the filename and increase the reference count. A store which was opened for
+        reading, or with other compression, is reopened in append-mode when writing is requested; the 
+        store-object itself stays the same."""
+        name = os.path.abspath(filename)
+        entry = self._enter(name)
+        try:
+            if entry[0] is not None and entry[0].is_open and not entry[6] and self._version(name) != entry[5]:
+                entry[0].close()  # Replaced or changed by another process (not while writing it in this process)
+            if entry[0] is None or not entry[0].is_open:
+                entry[0] = BizHDFStore(name, mode, complevel, complib)
+                entry[5] = self._version(name)
+            elif mode != 'r' and (entry[0]._mode == 'r' or (entry[0]._complevel, entry[0]._complib) != (complevel, complib)):
+                entry[0]._complevel, entry[0]._complib = complevel, complib
+                entry[0].open('a')
+        except:
+            self.release(filename)
+            raise
+        self._start_reaper()
+        return entry[0]
+    def release(self, filename):
+        """Decrease the reference count of the file. The file stays open for reuse until it is idle too long,
+        or is closed immediately when the files are shared with other processes."""
+        name = os.path.abspath(filename)
+        with self._lock:
+            entry = self._entries[name]
+            entry[1] -= 1
+            entry[2] = time.time()
+        entry[4] -= 1
+        try:
+            if self.shared_lock is not None and entry[4] == 0 and entry[0] is not None and entry[0].is_open:
+                if entry[0]._mode != 'r': entry[0].flush()
+                entry[0].close()
+        finally:
+            self._hdf_lock.release()
+            if self.shared_lock is not None: self.shared_lock.release()
+            entry[3].release()
+    @staticmethod
+    def _version(name):
+        """Return the identity and version of the file: inode, size, mtime and the generation in its lock-file, which
+        must be held."""
+        try:
+            stat = os.stat(name)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime, FileLock.get(name + '.lock').generation()
+    @contextmanager
+    def store(self, filename, mode='r', complevel=9, complib='blosc'):
+        """Context manager for using a pooled store: with pool.store(filename, 'a') as hdf: ...
+        Reading holds the lock-file shared, writing exclusively, see write."""
+        if mode != 'r':
+            with self.write(filename, complevel, complib) as hdf:
+                yield hdf
+            return
+        with FileLock.get(os.path.abspath(filename) + '.lock').shared():
+            hdf = self.acquire(filename, mode, complevel, complib)
+            try:
+                yield hdf
+            finally:
+                self.release(filename)
+    @contextmanager
+    def write(self, filename, complevel=9, complib='blosc'):
+        """Context manager for writing the pooled store in place, safe for any number of threads and processes: 
+        the writer holds the lock-file {filename}.lock exclusively, so no other process reads or writes the file
+        meanwhile. Writes can be nested, e.g. to remove many keys at once; when the outermost write is left, the 
+        store is flushed and reopened for reading, for a store must not be open for writing in a process which 
+        doesn't hold the lock, and the generation in the lock-file is increased, so the readers reopen it."""
+        name = os.path.abspath(filename)
+        with FileLock.get(name + '.lock'):
+            hdf = self.acquire(name, 'a', complevel, complib)
+            entry = self._entries[name]
+            entry[6] += 1
+            try:
+                yield hdf
+            finally:
+                entry[6] -= 1
+                try:
+                    if entry[6] == 0 and hdf.is_open and hdf._mode != 'r':
+                        hdf.flush()
+                        hdf.open('r')
+                        FileLock.get(name + '.lock').bump()
+                        entry[5] = self._version(name)
+                finally:
+                    self.release(name)
+    @contextmanager
+    def exclusive(self, filename):
+        """Context manager for exclusive use of the file while no store is open, e.g. for replacing the file.
+        Other users of the file wait until the context is left and reopen the file on their next use. Only this 
+        file is locked: pytables is locked only while the store is closed, so the other files can be used meanwhile 
+        (e.g. during a ptrepack of this file). Other processes are not excluded; use write or the lock-file for that."""
+        name = os.path.abspath(filename)
+        entry = self._entry(name)
+        entry[3].acquire()
+        try:
+            with self.locked():
+                if entry[0] is not None and entry[0].is_open:
+                    if entry[0]._mode != 'r': entry[0].flush()
+                    entry[0].close()
+            yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                entry[2] = time.time()
+            entry[3].release()
+    @contextmanager
+    def locked(self):
+        """Context manager for using pytables outside the pool, e.g. for temporary files. When shared with other
+        processes, it serializes the use of shared files which are not pooled too, like the index-files."""
+        if self.shared_lock is not None: self.shared_lock.acquire()
+        self._hdf_lock.acquire()
+        try:
+            yield
+        finally:
+            self._hdf_lock.release()
+            if self.shared_lock is not None: self.shared_lock.release()
+    def close(self, filename):
+        "Flush and close the file if it is open and not in use. Return True if the file is not open anymore."
+        name = os.path.abspath(filename)
+        with self._hdf_lock, self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return True
+            if entry[1] > 0:
+                return False
+            del self._entries[name]
+            if entry[0] is not None and entry[0].is_open:
+                if entry[0]._mode != 'r': entry[0].flush()
+                entry[0].close()
+        return True
+    def close_idle(self, idle_timeout=None):
+        "Close all files which are not used for the specified number of seconds."
+        idle_timeout = self.idle_timeout if idle_timeout is None else idle_timeout
+        with self._lock:
+            names = [name for name, entry in self._entries.items() if entry[1] == 0 and time.time() - entry[2] >= idle_timeout]
+        for name in names:
+            self.close(name)
+    def close_all(self):
+        "Flush and close all files which are not in use; called at exit of the process."
+        for name in self._entries.keys():
+            self.close(name)
+    def _start_reaper(self):
+        if self._reaper is not None or not self.idle_timeout:
+            return
+        def reap():
+            while True:
+                time.sleep(max(self.idle_timeout / 2.0, 1))
+                self.close_idle()
+        with self._lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=reap, name='StorePool-reaper')
+                self._reaper.daemon = True
+                self._reaper.start()
+
+store_pool = StorePool()
+
+def cache_entry(stat, hash, rows, columns, size):
+    "Return the index-entry for a stored dataframe."
+    return {'stat': stat, 'hash': hash or None, 'rows': rows, 'columns': columns,
+            'size': size, 'last_access': time.time(), 'hits': 0, 'misses': 0}
+
+def frame_select(df, columns=None, where=None):
+    """Return the rows of the dataframe which match where, with only the columns (which are present). The where is 
+    an expression like 'org_name == "x" & rows > 10' (see DataFrame.query and HDFStore.select) or a function which
+    returns a boolean series for a dataframe."""
+    if where is not None:
+        df = df[where(df)] if callable(where) else df.query(where)
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df
+
+class HDFBackend(object):
+    """Storage of the cache in one h5-file, table-format with the compression of the profile. The h5-file is opened
+    through the process-wide store_pool. Only plain ascii is supported for strings, see pipeline.source._flatten.
+    With compression 'auto', the profile is chosen on the first store in the process by compression_choose,
+    with a target write-throughput of compression_target MB/s.
+    The data_columns (a list or True for all columns) are indexed in the table, so a where on these columns is 
+    evaluated by pytables and only the matching rows are read."""
+    _compression_chosen = {}  # The profiles chosen by 'auto', by filename
+    chunk_itemsize = 256  # Minimum width of the strings of a dataframe which is stored in chunks, see put
+    def __init__(self, filename, compression='heavy', compression_target=50, data_columns=None):
+        self.filename = filename
+        self.compression = compression
+        self.compression_target = compression_target
+        self.data_columns = data_columns
+        self.filename_index = splitext(filename)[0] + '.index.json'
+        self.created = False
+        if not exists(self.filename):
+            path = split(self.filename)[0]
+            if not exists(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    pass  # Created by another thread or process
+            with store_pool.store(self.filename, 'a', *self.filters):
+                pass  # Append-mode, for another thread or process may create the file at the same time
+            self.created = True
+    @staticmethod
+    def exists(filename):
+        return exists(filename)
+    def get(self, key, columns=None, where=None):
+        """Return the dataframe, with only the columns and the rows matching where (see frame_select). The selection
+        is done by pytables when possible: an expression on the index and data_columns. Otherwise, e.g. for a 
+        function or a key stored without these data_columns, the complete dataframe is read and filtered."""
+        with store_pool.store(self.filename) as hdf:
+            if isinstance(where, basestring) or (columns is not None and where is None):
+                try:
+                    return hdf.select(key, where=where, columns=columns)
+                except (ValueError, TypeError, NameError, SyntaxError):
+                    pass  # Not a data_column; filter in memory
+            return frame_select(hdf.get(key), columns, where)
+    def iterate(self, key, chunksize):
+        "Return a generator of the dataframe in chunks of chunksize rows, each read by pytables on its own."
+        with store_pool.store(self.filename) as hdf:
+            rows = hdf.get_storer(key).nrows
+        for start in range(0, rows, chunksize):
+            with store_pool.store(self.filename) as hdf:
+                yield hdf.select(key, start=start, stop=start + chunksize)
+    @property
+    def filters(self):
+        "Return the complevel and complib for writing."
+        if self.compression == 'auto':
+            return compression_profiles[self._compression_chosen.get(self.filename, 'heavy')]
+        return compression_profiles[self.compression]
+    def put(self, key, df, stat, hash, attrs=None, chunk=None):
+        """Store the dataframe with its attributes and the general attrs (e.g. hashes per column) and return the index-entry.
+        With a chunk-number the dataframe is a chunk of rows: the first chunk (0) replaces the stored dataframe, the
+        following chunks are appended to it. The strings of the first chunk get a width of at least chunk_itemsize
+        characters, for the width of a table-column is fixed; a longer string in a following chunk raises ValueError."""
+        if self.compression == 'auto' and self.filename not in self._compression_chosen:
+            with store_pool.locked():
+                self._compression_chosen[self.filename] = compression_choose(df, self.compression_target)
+        with store_pool.store(self.filename, 'a', *self.filters) as hdf:
+            data_columns = self.data_columns if self.data_columns in (None, True) else [c for c in self.data_columns if c in df.columns]
+            if chunk:
+                hdf.append(key, df, data_columns=data_columns)
+            elif chunk == 0:
+                strings = [c for c in df.columns if df[c].dtype == object and (data_columns is True or c in (data_columns or []))]
+                hdf.put(key, df, format='table', data_columns=data_columns, 
+                        min_itemsize=dict([('values', self.chunk_itemsize)] + [(c, self.chunk_itemsize) for c in strings]))
+            else:
+                hdf.put(key, df, format='table', data_columns=data_columns)
+            storer = hdf.get_storer(key)
+            storer.attrs.stat = stat
+            if hash:
+                storer.attrs.hash = hash
+            if attrs:
+                storer.attrs.attrs = attrs
+            return self.entry(storer, stat, hash)
+    def attrs(self, key):
+        "Return the general attrs stored with the dataframe."
+        with store_pool.store(self.filename) as hdf:
+            return getattr(hdf.get_storer(key).attrs, 'attrs', None) or {}
+    def hash(self, key):
+        "Return the hash stored with the dataframe; raise KeyError when the key is not stored."
+        with store_pool.store(self.filename) as hdf:
+            if CacheIndex.key(key) not in hdf:
+                raise KeyError(key)
+            return getattr(hdf.get_storer(key).attrs, 'hash', None)
+    def entry(self, storer, stat, hash):
+        try:
+            columns = [str(c) for c in storer.non_index_axes[0][1]]
+        except (AttributeError, IndexError, TypeError):
+            columns = None
+        try:
+            size = long(storer.table.size_on_disk)
+        except AttributeError:
+            size = long(storer.nrows or 0) * getattr(getattr(storer, 'table', None), 'rowsize', 0)
+        return cache_entry(stat, hash, storer.nrows, columns, size)
+    def entries(self):
+        "Return the index-entries of all nodes in the h5-file, by key."
+        result = {}
+        with store_pool.store(self.filename) as hdf:
+            for key in hdf.keys():
+                try:
+                    storer = hdf.get_storer(key)
+                    result[key] = self.entry(storer, getattr(storer.attrs, 'stat', None), getattr(storer.attrs, 'hash', None))
+                except (KeyError, AttributeError, TypeError):
+                    continue
+        return result
+    def remove(self, key):
+        with store_pool.store(self.filename, 'a', *self.filters) as hdf:
+            if CacheIndex.key(key) in hdf:
+                hdf.remove(key)
+    def batch(self):
+        "Context manager for many writes (e.g. removes) at once, with the file opened for writing only once."
+        return store_pool.write(self.filename, *self.filters)
+    def size(self):
+        return os.path.getsize(self.filename)
+    def compact(self):
+        """Rewrite the h5-file with ptrepack, which gives back the space of removed and overwritten nodes.
+        The file can't be used by other threads and processes while it is compacted; other files can, see 
+        StorePool.exclusive. Return False if compacting failed."""
+        filename_tmp = self.filename + '.repack'
+        with FileLock.get(os.path.abspath(self.filename) + '.lock'), store_pool.exclusive(self.filename):
+            try:
+                if exists(filename_tmp): os.remove(filename_tmp)
+                complevel, complib = self.filters
+                subprocess.check_call(['ptrepack', '--chunkshape=keep', '--propindexes', '--complevel={}'.format(complevel)] + 
+                                      (['--complib={}'.format(complib)] if complib else []) + [self.filename, filename_tmp])
+                replace_file(filename_tmp, self.filename)
+                FileLock.get(os.path.abspath(self.filename) + '.lock').bump()
+            except (OSError, subprocess.CalledProcessError) as e:
+                print e
+                if exists(filename_tmp): os.remove(filename_tmp)
+                return False
+        return True
+
+class ColumnarBackend(object):
+    """Storage of the cache in a directory ({name}.columnar) with one columnar file per key, see biz.pandas.io.columnar.
+    Reading is memory-mapped, strings are stored as unicode. Every file is written to a temporary file and renamed.
+    A stored dataframe is never overwritten, for it may be memory-mapped by a reader (e.g. a reused column of an 
+    outdated result), which on Windows can't be removed or replaced: every store of a key writes a new generation
+    ({key}.{generation}.bcf) and removes the previous ones, or leaves them to a later store or compact when that 
+    fails. A dataframe which is stored in chunks gets a file per chunk: {key}.{generation}.bcf for the first, 
+    {key}.{generation}.{chunk}.bcf for the following ones, so appending a chunk doesn't rewrite the stored rows. The
+    attributes of the last chunk are the attributes of the dataframe.
+    Writers hold the lock-file of the directory, readers hold it shared while they find and map the files.
+    The files are not compressed, for compressed data can't be memory-mapped; the compression is ignored."""
+    extension = '.bcf'
+    def __init__(self, filename, compression=None, compression_target=None, data_columns=None):
+        self.filename = self.directory(filename)
+        self.filename_index = join(self.filename, 'index.json')
+        self.lock = FileLock.get(join(self.filename, 'cache.lock'))
+        self.created = not exists(self.filename)
+        if self.created:
+            try:
+                os.makedirs(self.filename)
+            except OSError:
+                pass  # Created by another thread or process
+    @staticmethod
+    def directory(filename):
+        return splitext(filename)[0] + '.columnar'
+    @classmethod
+    def exists(cls, filename):
+        return exists(cls.directory(filename))
+    @staticmethod
+    def name(key):
+        return hashlib.md5(CacheIndex.key(key)).hexdigest()
+    def path(self, key, generation, chunk=0):
+        return join(self.filename, '{}.{}{}{}'.format(self.name(key), generation, '.{}'.format(chunk) if chunk else '', self.extension))
+    def _generations(self, names=None):
+        """Return the files by name of the key and generation, in the order of the chunks: {name: {generation: [files]}},
+        for the names (default all)."""
+        files = defaultdict(lambda: defaultdict(dict))
+        for filename in os.listdir(self.filename):
+            parts = filename.split('.')
+            if '.' + parts[-1] != self.extension or (names is not None and parts[0] not in names): continue
+            numbers = [int(part) for part in parts[1:-1]] + [0, 0]
+            files[parts[0]][numbers[0]][numbers[1]] = join(self.filename, filename)
+        return {name: {generation: [chunks[chunk] for chunk in sorted(chunks)] for generation, chunks in generations.items()}
+                for name, generations in files.items()}
+    def generations(self, key):
+        "Return the files of the key by generation, in the order of the chunks."
+        return self._generations([self.name(key)]).get(self.name(key), {})
+    def paths(self, key):
+        "Return the files of the current generation of the key, in the order of the chunks; raise KeyError when it is not stored."
+        generations = self.generations(key)
+        if not generations:
+            raise KeyError(key)
+        return generations[max(generations)]
+    def _remove(self, paths):
+        "Remove the files; a file which is open or memory-mapped (Windows) is left, for a later store or compact."
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    def get(self, key, columns=None, where=None):
+        """Return the dataframe, with only the columns and the rows matching where (see frame_select). Only the 
+        columns and the names in the where-expression are read. The chunks of a dataframe are concatenated."""
+        names = None if columns is None or callable(where) else list(columns) + (re.findall('[A-Za-z_]\w*', where) if where else [])
+        with self.lock.shared():
+            frames = [columnar.read_frame(path, names) for path in self.paths(key)]
+        frames = [frame_select(frame, columns, where) for frame in frames]
+        return frames[0] if len(frames) == 1 else pd.concat(frames)
+    def iterate(self, key, chunksize):
+        """Return a generator of the dataframe in chunks of chunksize rows, on the memory-mapped files of its chunks.
+        Raise IOError when the key is stored again while it is iterated."""
+        with self.lock.shared():
+            paths = self.paths(key)
+        for path in paths:
+            with self.lock.shared():
+                if self.paths(key) != paths:
+                    raise IOError('Key "{}" of "{}" stored again while iterating'.format(key, self.filename))
+                df = columnar.read_frame(path)
+            for start in range(0, len(df), chunksize):
+                yield df.iloc[start:start + chunksize]
+    def put(self, key, df, stat, hash, attrs=None, chunk=None):
+        """Store the dataframe with its attributes and the general attrs (json-serializable) and return the index-entry.
+        The dataframe, or its first chunk (see HDFBackend.put), is a new generation of the key; a following chunk is
+        written to a file of its own in the current generation."""
+        with self.lock:
+            generations = self.generations(key)
+            if chunk:
+                generation = max(generations)
+                paths = generations[generation][:chunk]
+            else:
+                generation = max(generations) + 1 if generations else 0
+                paths = []
+            paths.append(self.path(key, generation, chunk or 0))
+            columnar.write_frame(paths[-1], df, {'key': CacheIndex.key(key), 'stat': stat, 'hash': hash or None, 'attrs': attrs or {}})
+            if not chunk:
+                self._remove([path for g in generations for path in generations[g]])
+        rows = sum([columnar.read_header(path)['rows'] for path in paths[:-1]]) + len(df)
+        return cache_entry(stat, hash, rows, [str(c) for c in df.columns], sum([os.path.getsize(path) for path in paths]))
+    def attrs(self, key):
+        "Return the general attrs stored with the dataframe."
+        with self.lock.shared():
+            return columnar.read_attrs(self.paths(key)[-1]).get('attrs') or {}
+    def hash(self, key):
+        "Return the hash stored with the dataframe; raise KeyError when the key is not stored."
+        with self.lock.shared():
+            return columnar.read_attrs(self.paths(key)[-1]).get('hash')
+    def entries(self):
+        "Return the index-entries of the current generations of all keys in the directory."
+        result = {}
+        with self.lock.shared():
+            for name, generations in self._generations().items():
+                paths = generations[max(generations)]
+                headers = [columnar.read_header(path) for path in paths]
+                attrs = headers[-1]['attrs']
+                result[attrs['key']] = cache_entry(attrs.get('stat'), attrs.get('hash'), sum([header['rows'] for header in headers]), 
+                                                   [str(columnar._name(c['name'])) for c in headers[-1]['columns']],
+                                                   sum([os.path.getsize(path) for path in paths]))
+        return result
+    def remove(self, key):
+        with self.lock:
+            generations = self.generations(key)
+            self._remove([path for g in generations for path in generations[g]])
+    @contextmanager
+    def batch(self):
+        "Every key is a file of its own, so many writes at once need nothing in common."
+        yield
+    def size(self):
+        return sum([os.path.getsize(join(self.filename, f)) for f in os.listdir(self.filename)])
+    def compact(self):
+        "Remove the previous generations which could not be removed when they were replaced; removed files give back their space."
+        with self.lock:
+            for name, generations in self._generations().items():
+                self._remove([path for g in generations if g != max(generations) for path in generations[g]])
+        return True
+
+cache_backends = {'hdf': HDFBackend, 'columnar': ColumnarBackend}
+
+class CacheIndex(dict):
+    """In-memory index of a cache: key -> {stat, hash, rows, columns, size, last_access, hits, misses}.
+    The index is kept in a small sidecar-file of the backend (e.g. {name}.index.json next to the h5-file), loaded 
+    once per cache per process and updated on every store. Hit/miss-decisions are taken on the index only, so the
+    storage is only accessed for the keys which actually hit. When the sidecar is missing (e.g. a cache written 
+    before the index existed), it is built once from the backend. Changes and access statistics are saved once per
+    batch and at exit, see save_all. The sidecar is read and replaced under its lock-file ({sidecar}.lock), and the
+    changes of this process are merged into the sidecar on every save, for other processes may write to the same 
+    cache. When another process saved the sidecar since it was loaded, it is loaded again on the next lookup 
+    (see refresh), so a key which is evicted or overwritten by another process is not a hit."""
+    _indexes = {}
+    _indexes_lock = threading.Lock()
+    def __init__(self, backend):
+        super(CacheIndex, self).__init__()
+        self.backend = backend
+        self.filename_index = backend.filename_index
+        self.hits = self.misses = 0
+        self._saved = (0, 0)  # The hits and misses at the last load or save
+        self._changed = set()  # The keys changed since the last load or save
+        self._dirty = False
+        self._stat = None  # The file-attributes of the sidecar at the last load or save, see refresh
+        self._lock = threading.RLock()
+    @classmethod
+    def get(cls, backend):
+        "Return the index for the backend, loaded only once per process."
+        name = os.path.abspath(backend.filename_index)
+        with cls._indexes_lock:
+            if name not in cls._indexes:
+                index = cls(backend)
+                index.load()
+                cls._indexes[name] = index
+            return cls._indexes[name]
+    @classmethod
+    def save_all(cls):
+        "Save the access statistics of all indexes which changed since their last save."
+        for index in cls._indexes.values():
+            if index._dirty:
+                index.save()
+    @staticmethod
+    def key(key):
+        "Keys in the index are the node-paths in the h5-file, which always start with a slash."
+        return '/' + key.lstrip('/')
+    @classmethod
+    def load_all(cls):
+        "Reload all indexes, e.g. after other processes have written to the caches."
+        for index in cls._indexes.values():
+            index.load()
+    def _sidecar_stat(self):
+        "Return the file-attributes of the sidecar which change when it is replaced, or None when it is missing."
+        try:
+            s = os.stat(self.filename_index)
+        except OSError:
+            return None
+        return s.st_ino, s.st_size, s.st_mtime
+    def _read(self):
+        "Return the keys, hits and misses of the sidecar, or None when it is missing or corrupt."
+        if not exists(self.filename_index):
+            return None
+        try:
+            with open(self.filename_index) as f:
+                data = json.load(f)
+            return data['keys'] if 'keys' in data else data, data.get('hits', 0), data.get('misses', 0)
+        except (ValueError, AttributeError, KeyError) as e:
+            print e  # Corrupt index, rebuild it from the backend
+    def load(self):
+        with self._lock:
+            self.clear()
+            with FileLock.get(self.filename_index + '.lock'):
+                data = self._read()
+                self._stat = self._sidecar_stat()
+            if data is None:
+                self.rebuild()
+                return
+            self.update(data[0])
+            self.hits, self.misses = self._saved = data[1:]
+            self._changed.clear()
+            self._dirty = False
+    def refresh(self):
+        """Load the sidecar again when another process saved it since the last load or save of this process. The 
+        changes of this process which are not saved yet are kept, see _merge."""
+        with self._lock:
+            if self._sidecar_stat() == self._stat:
+                return
+            with FileLock.get(self.filename_index + '.lock'):
+                saved = self._merge()
+                self._stat = self._sidecar_stat()
+            if saved is not None:
+                self._saved = saved
+    def rebuild(self):
+        "Build the index from the entries in the backend and save it."
+        with self._lock, FileLock.get(self.filename_index + '.lock'):
+            self.clear()
+            for key, entry in self.backend.entries().items():
+                self[self.key(key)] = entry
+            self.save(merge=False)
+    def _merge(self):
+        """Apply the changes of this process to the sidecar-contents, which may be changed by other processes, and
+        make it the index. Return the hits and misses of the sidecar, or None when it is missing."""
+        data = self._read()
+        if data is None:
+            return None
+        keys, hits, misses = data
+        for key in self._changed:
+            if key in self:
+                keys[key] = self[key]
+            else:
+                keys.pop(key, None)
+        self.hits, self.misses = hits + self.hits - self._saved[0], misses + self.misses - self._saved[1]
+        self.clear()
+        self.update(keys)
+        return hits, misses
+    def save(self, merge=True):
+        with self._lock, FileLock.get(self.filename_index + '.lock'):
+            if merge:
+                self._merge()
+            filename_tmp = self.filename_index + '.tmp'
+            with open(filename_tmp, 'w') as f:
+                json.dump({'keys': self, 'hits': self.hits, 'misses': self.misses}, f)
+            replace_file(filename_tmp, self.filename_index)
+            self._stat = self._sidecar_stat()
+            self._saved = (self.hits, self.misses)
+            self._changed.clear()
+            self._dirty = False
+    def set(self, key, entry):
+        """Set the entry for the key. The access statistics of a previous entry are kept. The index is saved later, 
+        like the access statistics: once per batch (e.g. read_source.from_files) and at exit, see save_all."""
+        with self._lock:
+            previous = self.lookup(key)
+            if previous:
+                entry['hits'], entry['misses'] = previous.get('hits', 0), previous.get('misses', 0)
+            self[self.key(key)] = entry
+            self._changed.add(self.key(key))
+            self._dirty = True
+    def remove(self, key):
+        with self._lock:
+            self.pop(self.key(key), None)
+            self._changed.add(self.key(key))
+            self._dirty = True
+    def discard(self, key):
+        "Remove the key from the index of this process only, e.g. when it is not in the backend (anymore)."
+        with self._lock:
+            self.pop(self.key(key), None)
+            self._changed.discard(self.key(key))
+    def lookup(self, key):
+        return dict.get(self, self.key(key))
+    def access(self, key, hit):
+        "Register a hit or a miss for the key."
+        with self._lock:
+            entry = self.lookup(key)
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if entry is not None:
+                entry['hits' if hit else 'misses'] = entry.get('hits' if hit else 'misses', 0) + 1
+                if hit: entry['last_access'] = time.time()
+                self._changed.add(self.key(key))
+            self._dirty = True
+    @property
+    def size(self):
+        "The total size of all keys, without the space of removed and overwritten nodes."
+        return sum([entry.get('size') or 0 for entry in self.values()])
+
+atexit.register(CacheIndex.save_all)
+
+class Checksums(dict):
+    """Persistent memo of the checksums of the contents of files: absolute filename -> [mystat, md5]. The checksum
+    is computed streaming, and only again when the stat of the file changed. The memo is a json-file (checksums.json
+    next to the cache-files), loaded once per process and saved on every new checksum. The file is saved under its 
+    lock-file ({filename}.lock) and the new checksums of this process are merged into it, like CacheIndex.save, for
+    other processes (e.g. warm and an interactive session) may save it at the same time."""
+    blocksize = 2 ** 20
+    _memos = {}
+    _memos_lock = threading.Lock()
+    def __init__(self, filename):
+        super(Checksums, self).__init__()
+        self.filename = filename
+        self._lock = threading.RLock()
+        self._changed = set()  # The names with a new checksum since the last load or save
+        self.load()
+    @classmethod
+    def get(cls, filename):
+        "Return the memo for the filename, loaded only once per process."
+        name = os.path.abspath(filename)
+        with cls._memos_lock:
+            if name not in cls._memos:
+                cls._memos[name] = cls(filename)
+            return cls._memos[name]
+    def _read(self):
+        "Return the checksums in the file; empty when it is missing or corrupt."
+        if exists(self.filename):
+            try:
+                with open(self.filename) as f:
+                    return json.load(f)
+            except ValueError as e:
+                print e  # Corrupt memo, compute the checksums again
+        return {}
+    def load(self):
+        with self._lock:
+            self.clear()
+            self.update(self._read())
+            self._changed.clear()
+    def save(self):
+        "Save the memo, merged with the checksums saved by others. A failure is printed, for the memo is only a memo."
+        try:
+            with self._lock, FileLock.get(self.filename + '.lock'):
+                data = self._read()
+                data.update([(name, self[name]) for name in self._changed])
+                filename_tmp = '{}.{}.tmp'.format(self.filename, os.getpid())
+                with open(filename_tmp, 'w') as f:
+                    json.dump(data, f)
+                replace_file(filename_tmp, self.filename)
+                self.clear()
+                self.update(data)
+                self._changed.clear()
+        except (IOError, OSError) as e:
+            print e
+    def checksum(self, filename):
+        "Return the md5-checksum of the contents of the file."
+        name = os.path.abspath(filename)
+        stat = mystat(filename)
+        with self._lock:
+            entry = dict.get(self, name)
+            if entry and entry[0] == stat:
+                return entry[1]
+        h = hashlib.md5()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(self.blocksize), ''):
+                h.update(block)
+        with self._lock:
+            self[name] = [stat, h.hexdigest()]
+            self._changed.add(name)
+            self.save()
+        return h.hexdigest()
+
+class CacheMiss(IOError):
+    "The dataframe is not in the cache (anymore), though the index of this process has it, see Cache.retrieve."
+
 class Cache(object):
-    """pandas.HDFStore is encapsulated in the Cache-object, which is responsible for closing down the h5-file.
+    """The storage of the cached dataframes is encapsulated in the Cache-object. The storage is done by a backend:
+    'hdf' (default) stores all keys in one h5-file through the process-wide store_pool, 'columnar' stores every key
+    in its own memory-mappable file, see biz.pandas.io.columnar. Presence and hash of a key are looked up in 
+    the CacheIndex, the backend is only accessed for retrieving and storing data.
+    The size of the cache can be bounded by max_bytes; the least recently used keys are evicted when it is
+    exceeded. Keys which are not accessed for max_age days are evicted too. The limits are checked on a store, at 
+    most once per maintain_interval seconds, so the cache may exceed max_bytes in between. After eviction the file
+    is compacted in the background, for PyTables never gives back the space of removed or overwritten nodes.
+    The compression is a profile-name from compression_profiles or 'auto', or a dict with the profile by process 
+    name, see compression_profile.
+    The keys are the filenames (cache_key 'path'), or the checksums of the contents of the files (cache_key 
+    'content'), so identical files, e.g. a delivery copied to another date, share their cached results.
     The stored object is always a pandas DataFrame, the returned object is also always a pandas DataFrame.
     Internally a biz DataFrame is used, it is the responsibility of the caller to convert the returned object."""
-    def __init__(self, filename, process_name=None):
+    compact_ratio = 1.5  # Compact when the file is this much larger than the size of its keys.
+    compact_min_bytes = 2 ** 20  # No use in compacting small files.
+    _compacting = set()  # Files which are being compacted or failed to compact in this process.
+    partial = 'partial'  # The hash of a dataframe which is being stored in chunks, so it is never a hit
+    maintain_interval = 60  # Seconds between the checks of the size- and age-limits on a store, see maintain
+    def __init__(self, filename, process_name=None, max_bytes=None, max_age=None, backend='hdf', 
+                 compression='heavy', compression_target=50, data_columns=None, cache_key='path'):
         self._filename = filename.format(process=process_name) if re.match('.*\{process}', filename) and process_name else filename
-        if not os.path.exists(self._filename):
-            path = split(self._filename)[0]
-            if not exists(path): os.makedirs(path)
-            with BizHDFStore(self._filename, 'w'):
-                pass
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._maintained = 0  # The time of the last check of the limits
+        self.backend = cache_backends[backend](self._filename, compression_profile(compression, process_name), 
+                                               compression_target, data_columns)
+        if cache_key not in ('path', 'content'):
+            raise ValueError('Cache_key must be "path" or "content", found "{}"'.format(cache_key))
+        self.cache_key = cache_key
+        if cache_key == 'content':
+            self.checksums = Checksums.get(join(split(self._filename)[0], 'checksums.json'))
+        if self.backend.created:
+            CacheIndex.get(self.backend).rebuild()  # Discard the index of removed storage
+        self.index = CacheIndex.get(self.backend)
+    @staticmethod
+    def exists(filename, process_name=None, backend='hdf'):
+        "Return whether the cache for the filename and process is present."
+        filename = filename.format(process=process_name) if re.match('.*\{process}', filename) and process_name else filename
+        return cache_backends[backend].exists(filename)
     def key_from_filename(self, filename, **kwargs):
-        "Return the filename (without drive) and all kwargs as extra argument with file."
+        """Return the filename (without drive) and all kwargs as extra argument with file. With cache_key 'content'
+        the checksum of the contents replaces the filename."""
         s_arg = ':' + hashlib.md5(str([(k, kwargs[k]) for k in sorted(kwargs)])).hexdigest() if kwargs else ''
+        if self.cache_key == 'content':
+            return 'content/' + self.checksums.checksum(filename) + s_arg
         return splitdrive(filename)[1].replace('\\', '/') + s_arg
+    def _hash_equal(self, entry, hash):
+        return entry is not None and ((not hash and not entry.get('hash')) or entry.get('hash') == hash)
     def hash_equal(self, filename, hash, **kwargs):
-        result = False
-        with BizHDFStore(self._filename, 'r') as hdf:
-            attrs = hdf.get_storer(self.key_from_filename(filename, **kwargs)).attrs
-            result = ((not hash and not hasattr(attrs, 'hash')) or \
-                      (hasattr(attrs, 'hash') and attrs.hash == hash))
-        return result        
+        return self._hash_equal(self.index.lookup(self.key_from_filename(filename, **kwargs)), hash)
+    def valid(self, filename, hash=None, **kwargs):
+        """Return whether the specified filename is in the cache with the present file-attributes, without 
+        registering a hit or a miss (see present).
+        The drive-letter of the file is ignored, so the filesystem is portable with regard to drive-letter.
+        With cache_key 'content' the key itself identifies the contents, so the file-attributes are not compared."""
+        self.index.refresh()
+        entry = self.index.lookup(self.key_from_filename(filename, **kwargs))
+        return self._hash_equal(entry, hash) and (self.cache_key == 'content' or entry.get('stat') == mystat(filename))
     def present(self, filename, hash=None, **kwargs):
-        """Look up the specified filename and return whether it is in the cache with the present file-attributes.
-        The drive-letter of the file is ignored, so the filesystem is portable with regard to drive-letter."""
-        result = self.hash_equal(filename, hash, **kwargs)
-        if result:
-            with BizHDFStore(self._filename, 'r') as hdf:
-                attrs = hdf.get_storer(self.key_from_filename(filename, **kwargs)).attrs
-                result = hasattr(attrs, 'stat') and attrs.stat == mystat(filename)
+        "Look up the specified filename and return whether it is validly in the cache; register the hit or miss."
+        result = self.valid(filename, hash=hash, **kwargs)
+        self.index.access(self.key_from_filename(filename, **kwargs), result)
         return result
-    def retrieve(self, filename, hash=None, **kwargs):
-        "Get the contents of the cache, based on the filename. If the filename is not present, raise error."
-        result = None
+    def retrieve(self, filename, hash=None, columns=None, where=None, **kwargs):
+        """Get the contents of the cache, based on the filename. If the filename is not present, raise error.
+        Only the columns and the rows matching where are returned, see frame_select.
+        When the stored dataframe is missing or has another hash than the index (e.g. it is evicted or overwritten
+        by another process since the lookup), the key is removed from the index and CacheMiss is raised."""
         if not self.hash_equal(filename, hash, **kwargs):
             raise IOError('Hash code for "{}" not correct'.format(filename))
-        with BizHDFStore(self._filename, 'r') as hdf:
-            result = hdf.get(self.key_from_filename(filename, **kwargs))
-        return result
-    def store(self, filename, df, hash=None, **kwargs):
+        key = self.key_from_filename(filename, **kwargs)
+        try:
+            if (self.backend.hash(key) or None) == (hash or None):
+                return self.backend.get(key, columns, where)
+        except (KeyError, IOError, OSError):
+            pass
+        self.index.discard(key)
+        raise CacheMiss('"{}" is not in the cache (anymore) with hash {}'.format(filename, hash))
+    def iterate(self, filename, hash=None, chunksize=100000, **kwargs):
+        """Return a generator of the contents of the cache in chunks of chunksize rows, for a dataframe which 
+        doesn't fit in memory. If the filename is not present, raise error."""
+        if not self.hash_equal(filename, hash, **kwargs):
+            raise IOError('Hash code for "{}" not correct'.format(filename))
+        return self.backend.iterate(self.key_from_filename(filename, **kwargs), chunksize)
+    def stale(self, filename, **kwargs):
+        """Return the cached dataframe and its general attrs for the filename regardless of its hash, e.g. for reusing
+        the unchanged parts of an outdated result. Return None if it is not cached for the present file-attributes."""
+        key = self.key_from_filename(filename, **kwargs)
+        entry = self.index.lookup(key)
+        if entry is None or (self.cache_key != 'content' and entry.get('stat') != mystat(filename)):
+            return None
+        return self.backend.get(key), self.backend.attrs(key)
+    def store(self, filename, df, hash=None, attrs=None, chunk=None, **kwargs):
         """Put the data in the appropriate place and update the file-stats. Only native DataFrame is supported, 
-        so it is temporarily converted to pd.DataFrame and reverted to original type when returned."""
-        with BizHDFStore(self._filename, 'a') as hdf:
-            try:
-                c = df.__class__
-                df.__class__= pd.DataFrame
-                hdf.put(self.key_from_filename(filename, **kwargs), df, format='table')
-                hdf.get_storer(self.key_from_filename(filename, **kwargs)).attrs.stat = mystat(filename)
-                if hash:
-                    hdf.get_storer(self.key_from_filename(filename, **kwargs)).attrs.hash = hash
-                df.__class__ = c
-            except Exception as e:
-                print e
+        so it is temporarily converted to pd.DataFrame and reverted to original type when returned.
+        The general attrs (json-serializable, e.g. hashes per column) are stored with the data, see stale.
+        A large dataframe can be stored in chunks of rows, numbered from 0: all chunks but the last are stored with
+        the hash partial, see DataframeProcessor._process_chunks. Return whether the data is stored."""
+        key = self.key_from_filename(filename, **kwargs)
+        c = df.__class__
+        stored = False
+        try:
+            df.__class__= pd.DataFrame
+            self.index.set(key, self.backend.put(key, df, mystat(filename), hash, attrs, chunk))
+            stored = True
+        except Exception as e:
+            print e
+        finally:
+            df.__class__ = c
+        if (self.max_bytes or self.max_age) and time.time() - self._maintained >= self.maintain_interval:
+            self._maintained = time.time()
+            if (self.max_bytes and self.backend.size() > self.max_bytes) or self.max_age:
+                self.maintain()
+        return stored
+    def keys(self):
+        return self.index.keys()
+    def remove(self, key):
+        "Remove the key (as returned by key_from_filename or keys) from the cache."
+        self.backend.remove(key)
+        self.index.remove(key)
+    def evict(self, max_bytes=None, max_age=None):
+        """Remove all keys which are not accessed for max_age days, then remove the least recently used keys 
+        until the size of the remaining keys is within max_bytes. Return the removed keys."""
+        max_bytes = max_bytes or self.max_bytes
+        max_age = max_age or self.max_age
+        by_access = sorted(self.index.items(), key=lambda item: item[1].get('last_access') or 0)
+        evicted = []
+        if max_age:
+            evicted += [key for key, entry in by_access if time.time() - (entry.get('last_access') or 0) > max_age * 24 * 3600]
+        if max_bytes:
+            size = sum([entry.get('size') or 0 for key, entry in by_access if key not in evicted])
+            for key, entry in by_access:
+                if size <= max_bytes: break
+                if key in evicted: continue
+                evicted.append(key)
+                size -= entry.get('size') or 0
+        if evicted:
+            with self.backend.batch():
+                for key in evicted:
+                    self.remove(key)
+        return evicted
+    def compact(self):
+        "Give back the space of removed and overwritten keys; not retried in this process when it fails."
+        if self._filename in self._compacting:
+            return
+        self._compacting.add(self._filename)
+        if self.backend.compact():
+            self._compacting.discard(self._filename)
+    def maintain(self, max_bytes=None, max_age=None, background=True):
+        """Evict keys according to the size- and age-limits and compact the file in the background if it
+        contains much space which is not used by any key. Return the evicted keys."""
+        evicted = self.evict(max_bytes, max_age)
+        size = self.backend.size()
+        if size > self.compact_min_bytes and size > self.index.size * self.compact_ratio and self._filename not in self._compacting:
+            if background:
+                threading.Thread(target=self.compact, name='Cache-compact').start()
+            else:
+                self.compact()
+        return evicted
+    def stats(self):
+        """Return a dataframe with per key the number of rows, the size on disk, the hits, misses and hit rate
+        and the last access."""
+        columns = ['rows', 'size', 'hits', 'misses', 'hit_rate', 'last_access']
+        df = pd.DataFrame.from_dict(dict(self.index), orient='index') if self.index else pd.DataFrame(columns=columns)
+        for column in columns:
+            if column not in df: df[column] = np.nan
+        df['hit_rate'] = df.hits / (df.hits + df.misses)
+        df['last_access'] = pd.to_datetime(df.last_access, unit='s')
+        return df[columns]
 
 def path_match(pattern, path, flags=re.I):
     """Return True if the supplied path matches the pattern. The pattern can contain subdirs, 
@@ -140,17 +1022,23 @@ class read_source(object):
     Storing back data must be designed and implemented.
     Options can be specified on the class-level and are overridden the instance-level options. 
     ToDo: return data for multiple dates; incorrectly now assumed to work as slice!!!"""
+    profile_max_rows = 100000  # The number of rows of the profile that are kept, the latest; see profile
+    warm_save_interval = 30  # Seconds between the saves of the indexes of the caches while warming, see warm
     default_options = Options(level_last=None, filename='.*', 
                               data_root=r"P:\data", metadata_root=r"P:\metadata", cache_root=r"P:\cache", 
                               file_cache='{process}.h5', from_cache=True, to_cache=True, level_cache=3, 
                               merge_sources=False, merge_dates=True, pipeline=[], ignore_path_dates=False,
-                              reader_kwargs={}, filename_cleaner='filename_canonical')
+                              reader_kwargs={}, filename_cleaner='filename_canonical',
+                              cache_max_bytes=None, cache_max_age=None, cache_backend='hdf', 
+                              compression='heavy', compression_target=50, workers=None, executor='thread',
+                              file_catalog='catalog.json', lazy=False, columns=None, where=None, data_columns=None,
+                              cache_key='path', chunksize=None)
     def __init__(self, level_last=None, filename=None, levels=None, 
                  data_root=None, metadata_root=None, cache_root=None, 
                  file_cache=None, from_cache=None, to_cache=None, level_cache=None, 
                  merge_sources=None, merge_dates=None, pipeline=None,
                  filename_cleaner=None, max_level_date=None, max_level_file=None, 
-                 ignore_path_dates=None, reader_kwargs=None, 
+                 ignore_path_dates=None, reader_kwargs=None, cache_max_bytes=None, cache_max_age=None,
                  options=None, **kwargs):
         """The data-source is specified by giving a data-root and names for the levels. Default 3 levels are used, 
         but a different number can be specified by:
@@ -161,8 +1049,28 @@ class read_source(object):
         A root-starting 'levels'-argument precedes the separate leveln=-keywords.
         The filename may also contain a directory, separated by forward slash: 'extract/.*dump\.csv'
         If the filename is found, all level-indicators are ignored and just the specified file is read.
+        The size of every cache-file ({process}.h5) can be bounded with cache_max_bytes, keys which are not accessed
+        for cache_max_age days are evicted from the cache. The cache_backend is 'hdf' (default) or 'columnar'.
+        The compression of the cache-files can be set per pipeline-step: compression={'input': 'fast', 'map': 'heavy'},
+        a profile of 'auto' chooses the heaviest compression with a write-throughput of compression_target MB/s.
+        With workers=n the files of a selection are loaded in parallel by n threads, or n processes with 
+        executor='process'; the result is identical to loading the files one by one.
+        The data-tree is walked through the catalog file_catalog in the cache_root, which lists only the directories
+        which changed since the previous walk, see Catalog. With file_catalog=None the tree is walked on disk.
+        With lazy=True, indexing returns a generator of (date, canonical filename, dataframe), see iterate;
+        for batches of rows over the files, see chunks.
+        Only the columns and the rows matching where (see frame_select) are returned; both are pushed down to the
+        retrieve of the last pipeline-step from the cache. The data_columns are indexed in the h5-files, so a where
+        on these columns reads only the matching rows.
+        With cache_key='content' the results are cached by the checksum of the file, so identical deliveries share
+        their cached results, see Cache.
+        With chunksize=n a file which doesn't fit in memory is read and computed in chunks of n rows and appended to
+        the caches, see DataframeProcessor._process_chunks; combine it with columns and where to get a selection.
+        The caches can be filled beforehand with warm, or from the command line, see biz.pandas.core.warm.
+        The pipeline is a list of steps, or a DAG of steps, see DataframeProcessor.add_pipeline.
         Parameters can be set on 3 levels:"""
         from biz.pandas.core.collect import file_date   # Do it here; at module-level a circular reference is created    
+        from biz.pandas.core.catalog import Catalog
         def get_levels(filename, level_last, levels, **kwargs):
             "Return the levels as specified. The levels can be specified by index (starting at 0) and by specifying a sequence of levels."
             if exists(filename):
@@ -205,25 +1113,37 @@ class read_source(object):
                                 to_cache=to_cache, level_cache=level_cache, merge_sources=merge_sources, merge_dates=merge_dates,
                                 pipeline=pipeline, filename_cleaner=filename_canonical, max_level_date=max_level_date, 
                                 max_level_file=max_level_file, ignore_path_dates=ignore_path_dates, reader_kwargs=reader_kwargs,
-                                **kwargs)
+                                cache_max_bytes=cache_max_bytes, cache_max_age=cache_max_age, **kwargs)
         self._levels = get_levels(**options)
         self._file_cache = join(options.cache_root,
                                 join(*self._levels[:options.level_cache]),
                                 options.file_cache)
         self._path = join(options.data_root, *self._levels)  # Must get solution for case-sensitive filesystem like on Linux
-        if 'map_columns' in kwargs and kwargs['map_columns'] and 'map' not in options.pipeline: options.pipeline.append('map')
+        if 'map_columns' in kwargs and kwargs['map_columns'] and 'map' not in options.pipeline and isinstance(options.pipeline, list): 
+            options.pipeline.append('map')
         self._filename_cleaner = eval(options.filename_cleaner) if isinstance(options.filename_cleaner, basestring)  else options.filename_cleaner
         # The filenames are stored by date and index-number. The index here is a multi-index, first date, then an index-number
         # All dates on all (sub-)levels are indexed 
         filenames_by_date = defaultdict(list)
         self.options = options
+        catalog = Catalog.get(join(options.cache_root, options.file_catalog)) if options.file_catalog else None
+        walk = catalog.walk if catalog else os.walk
+        def path_date(dirname):
+            r = re.match('.*?(\d+\-\d+\-\d+)', split(dirname)[1])  # In the future, add several deliveries on one day? Subdirs/timestamps?
+            if r:
+                try:
+                    return str(pd.to_datetime(r.group(1)))
+                except Exception as e:
+                    print e  # ToDo: integrated logging/progress info  etc
+        def memoized_date(path, function):
+            return catalog.date(path, function) if catalog else function(path)
         if exists(options.filename):
             # The filename exists; single specified file, look no further.
             self._path = split(options.filename)[0]
             filenames_by_date[pd.to_datetime(file_date(options.filename))].append(options.filename)
         elif options.ignore_path_dates:
             # Don't assume path dates, but access the 'raw' path-structure:
-            for dirpath1, dirnames1, filenames1 in os.walk(self._path):
+            for dirpath1, dirnames1, filenames1 in walk(self._path):
                 if options.max_level_file is not None and \
                    levels_path(dirpath1) - levels_path(self._path) > options.max_level_file:
                     continue
@@ -233,21 +1153,17 @@ class read_source(object):
                     full_filename = join(dirpath1, filename1)
                     if path_match(options.filename, full_filename):
                         # Add to dataframe, make index:
-                        filenames_by_date[pd.to_datetime(file_date(full_filename))].append(full_filename)
+                        filenames_by_date[pd.to_datetime(memoized_date(full_filename, file_date))].append(full_filename)
         else:
             # Take path-dates as source for timestamp, regardless of dates of files (standard collection-procedure)
-            for dirpath1, dirnames1, filenames1 in os.walk(self._path):
+            for dirpath1, dirnames1, filenames1 in walk(self._path):
                 if max_level_date is not None and levels_path(dirpath1) - levels_path(self._path) > max_level_date:
                     continue
                 for dirname1 in dirnames1:
-                    r = re.match('.*?(\d+\-\d+\-\d+)', dirname1)  # In the future, add several deliveries on one day? Subdirs/timestamps?
-                    if r:
-                        try:
-                            date = pd.to_datetime(r.group(1))
-                        except Exception as e:
-                            print e  # ToDo: integrated logging/progress info  etc
-                            continue
-                        for dirpath2, dirnames2, filenames2 in os.walk(join(dirpath1, dirname1)):
+                    date = memoized_date(join(dirpath1, dirname1), path_date)
+                    if date:
+                        date = pd.to_datetime(date)
+                        for dirpath2, dirnames2, filenames2 in walk(join(dirpath1, dirname1)):
                             if options.max_level_file is not None and \
                                levels_path(dirpath2) - levels_path(join(dirpath1, dirname1)) > options.max_level_file:
                                 continue
@@ -257,6 +1173,8 @@ class read_source(object):
                                 if path_match(options.filename, join(dirpath2, filename2)):
                                     # Add to dataframe, make index:
                                     filenames_by_date[date].append(join(dirpath2, filename2))
+        if catalog:
+            catalog.commit()
         # Now contruct TWO series: a timeseries with the string-date as value, and a multi-index series
         # with the string-date as first key and indexnum as second key. The timeseries can be used as regular date-index.
         self.dates = pd.Series([str(k) for k in filenames_by_date.keys()], filenames_by_date.keys(), name='date').sort_index()
@@ -266,6 +1184,47 @@ class read_source(object):
             for filename in l:
                 filenames_total[self._filename_cleaner(filename)].append(filename)
         self.filenames_index = pd.concat({k: pd.Series(filenames_total[k], name='filename') for k in filenames_total})
+        self._profile = deque(maxlen=self.profile_max_rows)  # The profiles of the processed files, see profile
+    @property
+    def cache_kwargs(self):
+        "The keyword-arguments for the Cache-objects of the pipeline-steps."
+        return {'max_bytes': self.options.cache_max_bytes, 'max_age': self.options.cache_max_age, 
+                'backend': self.options.cache_backend, 'compression': self.options.compression, 
+                'compression_target': self.options.compression_target, 'data_columns': self.options.data_columns,
+                'cache_key': self.options.cache_key}
+    def caches(self):
+        "Return the existing caches of the pipeline-steps by step."
+        return {step: Cache(self._file_cache, step, **self.cache_kwargs) for step in self.options.pipeline 
+                if Cache.exists(self._file_cache, step, self.options.cache_backend)}
+    def cache_stats(self):
+        """Return a dataframe with the cache-statistics of the files of this source, by pipeline-step and cache-key:
+        the number of rows, size on disk, hits, misses, hit rate and last access."""
+        result = {}
+        for step, cache in self.caches().items():
+            keys = [CacheIndex.key(cache.key_from_filename(filename, **self.options.reader_kwargs)) for filename in self._filenames.values]
+            stats = cache.stats()
+            result[step] = stats[stats.index.isin(keys)]
+        return pd.concat(result, names=['step', 'key']) if result else pd.DataFrame()
+    def maintain(self, background=False):
+        "Evict and compact the caches of all pipeline-steps, according to cache_max_bytes and cache_max_age."
+        return {step: cache.maintain(background=background) for step, cache in self.caches().items()}
+    def profile(self, reset=False):
+        """Return a dataframe with the profile of all files processed by this source: per file and pipeline-step 
+        the status and action (see DataframeProcessor.plan), wall- and cpu-time, the time of storing in the cache,
+        the increase of the peak memory and the number of rows and columns. With reset, start a new profile.
+        Only the latest profile_max_rows rows are kept, so a long-running source doesn't grow without bound."""
+        columns = ['filename', 'step', 'status', 'action', 'wall', 'cpu', 'store', 'rss_delta', 'rows', 'columns']
+        result = pd.DataFrame(list(self._profile), columns=columns)
+        if reset:
+            self._profile.clear()
+        return result
+    def dump_profile(self, filename, reset=False):
+        "Write the profile to the file: json when the extension is .json, otherwise csv."
+        df = self.profile(reset)
+        if splitext(filename)[1].lower() == '.json':
+            df.to_json(filename, orient='records')
+        else:
+            df.to_csv(filename, index=False)
     def __call__(self, **kwargs):
         "Return a new read_source object, based on the current. Supplied arguments override arguments of current read_source."
         options = Options(self.options)
@@ -280,42 +1239,92 @@ class read_source(object):
         return stub
     def _nearest_index(self, arg):
         """Return the nearest date for the given argument."""
-        # No elegant 'pandas-way' for determining the best fit; time series don't support subtraction from date...
-        arg = pd.to_datetime(arg)  # Let pandas handle all conversions
-        # Find the nearest date, based on distance to index of dates:
-        i = self.dates.index[0]
-        d = abs(i - arg)
-        for i1 in self.dates.index:
-            if abs(arg - i1) < d:
-                d = abs(i1 - arg)
-                i = i1
-        return i
+        return self.nearest_dates([arg])[0]
+    def nearest_dates(self, dates, method='nearest'):
+        """Return the dates of the deliveries for the given dates (anything pd.to_datetime accepts) as DatetimeIndex,
+        resolved together by a binary search on the sorted dates. With method 'nearest' the closest delivery is 
+        returned, the earlier one on equal distance; with 'asof' the last delivery on or before the date, NaT when
+        there is none."""
+        index = self.dates.index.values  # Sorted datetime64-array
+        values = pd.to_datetime(list(dates)).values
+        if method == 'asof':
+            positions = index.searchsorted(values, side='right') - 1
+            result = index[np.maximum(positions, 0)]
+            result[positions < 0] = np.datetime64('NaT')
+            return pd.DatetimeIndex(result)
+        elif method != 'nearest':
+            raise ValueError('Method must be "nearest" or "asof", found "{}"'.format(method))
+        if len(index) == 1:
+            return pd.DatetimeIndex(index.repeat(len(values)))
+        right = np.clip(index.searchsorted(values), 1, len(index) - 1)
+        left = right - 1
+        return pd.DatetimeIndex(np.where(values - index[left] <= index[right] - values, index[left], index[right]))
+    def _select_files(self, filenames, file_select):
+        "Return the filenames which match the file-selection of a key, see __getitem__."
+        if file_select is None: return filenames
+        if isinstance(file_select, basestring):
+            return [filename for filename in filenames if re.match(file_select, self._filename_cleaner(filename), re.I)]
+        if isinstance(file_select, (list, tuple, set)):
+            return [filename for filename in filenames if any([re.match(file_select1, self._filename_cleaner(filename), re.I) for file_select1 in file_select])]
+        if isinstance(file_select, slice):
+            if isinstance(file_select.start, basestring) and isinstance(file_select.stop, basestring):
+                # Start and stop are string, get all sources between these borders (inclusive):
+                if file_select.step not in (-1, None, 1):
+                    raise ValueError('No other stepping allowed than -1, None or 1, found "{}"'.format(file_select.step))
+                if file_select.step == -1:
+                    file_select = slice(file_select.stop, file_select.start, -file_select.step)
+                return [filename for filename in filenames if file_select.start.lower() <= self._filename_cleaner(filename) <= file_select.stop.lower()]
+            else:
+                # No use, but return anyway. Sort by cleansed filename:
+                return sorted(filenames, key=lambda f: self._filename_cleaner(f))[file_select]
+    def _select(self, key):
+        """Return the deliveries for the key as list of (date, filenames), ordered by date; the key selects like
+        in __getitem__."""
+        date_select, file_select = key if isinstance(key, tuple) else (key, None)
+        try:
+            dates = self.dates[date_select]
+        except KeyError:
+            if isinstance(date_select, slice): return []
+            dates = self.dates[self._nearest_index(date_select)]
+        dates = [dates] if isinstance(dates, basestring) else dates.values
+        return [(date, self._select_files(self._filenames.loc[date].values, file_select)) for date in dates]
+    def iterate(self, key=slice(None)):
+        """Return a generator of (date, canonical filename, dataframe) for the key (as in __getitem__), ordered by 
+        date. Only one dataframe is loaded at a time, so the memory is bounded by the largest file."""
+        for date, filenames in self._select(key):
+            for filename in filenames:
+                yield date, self._filename_cleaner(filename), self.from_file(filename)
+    def chunks(self, key=slice(None), chunksize=100000):
+        """Return a generator of dataframes of chunksize rows (the last one possibly less) over all files for the 
+        key, in the order of iterate. The index has the date and canonical filename as first levels. At most one 
+        file and one chunk are in memory at a time."""
+        from biz.pandas.tools.merge import concat
+        pending, rows = [], 0
+        for date, name, df in self.iterate(key):
+            df = concat([df], keys=[(date, name)], names=['date', 'filename'])
+            start = 0
+            while start < len(df):
+                piece = df.iloc[start:start + chunksize - rows]
+                pending.append(piece)
+                rows += len(piece)
+                start += len(piece)
+                if rows == chunksize:
+                    yield pending[0] if len(pending) == 1 else concat(pending)
+                    pending, rows = [], 0
+        if pending:
+            yield pending[0] if len(pending) == 1 else concat(pending)
     def __iter__(self):
         return self[:]
     def __getitem__(self, key):
         """Get an item based on index or date. When a date is specified and the exact date does not exist,
         the closest source is selected. The semantics are completely identical to time series retrieving in pandas.
         Always return a dataframe with the data; when multiple sources are present, the index is a multi-index with 
-        the complete filename as extra level. When more than one date is returned, add an additional level with the date."""
+        the complete filename as extra level. When more than one date is returned, add an additional level with the date.
+        With the option lazy, a generator of (date, canonical filename, dataframe) is returned, see iterate."""
         from biz.pandas.tools.merge import concat        
+        if self.options.lazy:
+            return self.iterate(key)
         date_select, file_select = key if isinstance(key, tuple) else (key, None)
-        def multiple_files(filenames, file_select):
-            if file_select is None: return filenames
-            if isinstance(file_select, basestring):
-                return [filename for filename in filenames if re.match(file_select, self._filename_cleaner(filename), re.I)]
-            if isinstance(file_select, (list, tuple, set)):
-                return [filename for filename in filenames if any([re.match(file_select1, self._filename_cleaner(filename), re.I) for file_select1 in file_select])]
-            if isinstance(file_select, slice):
-                if isinstance(file_select.start, basestring) and isinstance(file_select.stop, basestring):
-                    # Start and stop are string, get all sources between these borders (inclusive):
-                    if file_select.step not in (-1, None, 1):
-                        raise ValueError('No other stepping allowed than -1, None or 1, found "{}"'.format(file_select.step))
-                    if file_select.step == -1:
-                        file_select = slice(file_select.stop, file_select.start, -file_select.step)
-                    return [filename for filename in filenames if file_select.start.lower() <= self._filename_cleaner(filename) <= file_select.stop.lower()]
-                else:
-                    # No use, but return anyway. Sort by cleansed filename:
-                    return sorted(filenames, key=lambda f: self._filename_cleaner(f))[file_select]
         def multiple_dates(date_select, file_select):
             "The key is the selecting key; can be slice or string (for date-slicing). When it is a string, it has proven to return multiple dates."
             try:
@@ -323,10 +1332,11 @@ class read_source(object):
             except KeyError:
                 return pd.DataFrame()
             result = {}
-            # Get all dates and all sources for the dates:
-            for date in dates.values:
-                dataframes = {self._filename_cleaner(filename): self.from_file(filename) for filename in \
-                              multiple_files(self._filenames.loc[date].values, file_select)}
+            # Get all dates and all sources for the dates; the files of all dates are loaded in one go:
+            selected = [(date, self._select_files(self._filenames.loc[date].values, file_select)) for date in dates.values]
+            frames = self.from_files([filename for date, filenames in selected for filename in filenames])
+            for date, filenames in selected:
+                dataframes = {self._filename_cleaner(filename): frames[filename] for filename in filenames}
                 result[date] = concat(dataframes) if self.options.merge_sources else dataframes
             # Now see how much the individual frames should be concatenated:
             if self.options.merge_sources:
@@ -365,7 +1375,9 @@ class read_source(object):
             if isinstance(dates, basestring):
                 # One delivery; can be single or multi-file:
                 # Return a dataframe with filename as index:
-                dataframes = {self._filename_cleaner(filename): self.from_file(filename) for filename in multiple_files(self._filenames.loc[dates].values, file_select)}
+                filenames = self._select_files(self._filenames.loc[dates].values, file_select)
+                frames = self.from_files(filenames)
+                dataframes = {self._filename_cleaner(filename): frames[filename] for filename in filenames}
                 if len(dataframes) == 0:
                     return pd.DataFrame()
                 elif len(dataframes) == 1:
@@ -383,16 +1395,249 @@ class read_source(object):
         return content in cache if attributes of file are not changed and the from_cache-flag is set.
         If content not in cache or cache is outdated, update the cache if to_cache-flag is set.
         CAVEAT: when storing data in the cache, it is stored in the default encoding (cp1252, now a constant).
-        Unicode is NOT supported by pytables, the underlying storage-package."""
-        import  biz.pandas as bp
+        Unicode is NOT supported by pytables, the underlying storage-package of the default 'hdf' cache_backend;
+        the 'columnar' cache_backend does support unicode."""
         # Get the total cache-table with filenames and store-data. If the cache gets very large, selection and 
         # updating of table on disk should be enabled (ToDo)
-        df = bp.DataFrame()
-        # Assign meta-data to dataframe, for identification of source etc.
-        df._biz_metadata.set(self._levels, self.options.metadata_root, self._filename_cleaner(filename))
-        df._biz_processor.set(filename, self.options.reader_kwargs, self.options.pipeline, self._file_cache, self.options.from_cache, self.options.to_cache)
+        df = frame_prepare(*self._frame_args(filename))
         df._biz_processor.process()
+        self._profile.extend(df._biz_processor.profile)
         return df
+    def _frame_args(self, filename):
+        "The arguments for frame_prepare: the metadata and processor-settings of the file."
+        return (self._levels, self.options.metadata_root, self._filename_cleaner(filename), filename, 
+                self.options.reader_kwargs, self.options.pipeline, self._file_cache, self.options.from_cache, 
+                self.options.to_cache, self.cache_kwargs, self.options.columns, self.options.where, self.options.chunksize)
+    def from_files(self, filenames):
+        """Return the data of the files in a dict by filename. With the option workers (> 1) the files are loaded 
+        in parallel by a pool of threads, or of processes with the option executor='process'. The pool returns the
+        results in the order of the filenames, so the result is identical to loading the files one by one.
+        Threads share the open cache-files of the store_pool. Worker-processes share the cache-files with a lock 
+        and close them after every use, see StorePool.share; the indexes of the caches are reloaded afterwards.
+        Changes of the metadata in a worker-process (e.g. new matches) are not returned, and a function as option
+        where can't be passed to a worker-process. The indexes of the caches are saved once, afterwards."""
+        filenames = list(filenames)
+        workers = min(self.options.workers or 1, len(filenames))
+        if workers < 2:
+            frames = [self.from_file(filename) for filename in filenames]
+        elif self.options.executor == 'process' and 'from_file' not in self.__dict__:
+            args = [self._frame_args(filename) for filename in filenames]
+            CacheIndex.save_all()
+            store_pool.close_all()
+            pool = multiprocessing.Pool(workers, frame_worker_init, (multiprocessing.RLock(),))
+            try:
+                results = pool.map(frame_process, args, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+            CacheIndex.load_all()
+            frames = []
+            for args1, (manager, profile) in zip(args, results):
+                df = frame_prepare(*args1)
+                df._data = manager
+                df._clear_item_cache()
+                df._biz_processor.profile = profile
+                self._profile.extend(profile)
+                frames.append(df)
+        elif self.options.executor in ('thread', 'process'):
+            pool = ThreadPool(workers)
+            try:
+                frames = pool.map(self.from_file, filenames, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            raise ValueError('Executor must be "thread" or "process", found "{}"'.format(self.options.executor))
+        CacheIndex.save_all()
+        return dict(zip(filenames, frames))
+    def cached(self, filename):
+        """Return whether the result of the pipeline for the file is validly cached, from the plan without loading any data.
+        The lookups are not registered as hits or misses of the caches."""
+        df = frame_prepare(*self._frame_args(filename))
+        return all([p.action != 'compute' for p in df._biz_processor.plan(record=False)])
+    def warm(self, dates=slice(None), files=None, workers=None, executor=None, progress=None):
+        """Run the pipeline for the files of the dates (a key as in __getitem__, default all) and files (a file-selection,
+        as the second part of the key) whose result is not validly cached, so the caches are filled before the data
+        is used. The files are processed by workers threads, or processes with executor='process' (default the
+        options); the data is not returned, so only the files being processed are in memory. Files which are cached
+        are skipped, so an interrupted warm resumes with the remaining files when it is run again. A failing file is
+        reported and doesn't stop the others. The indexes of the caches are saved at least every warm_save_interval 
+        seconds, so the progress is kept when the run is killed.
+        The progress is logged per file, and passed to progress(done, total, filename, status) if given.
+        Return a dataframe with per file the date, status ('cached', 'warmed' or 'failed') and seconds."""
+        if not self.options.to_cache:
+            raise ValueError('Warming the caches needs the option to_cache')
+        workers = self.options.workers if workers is None else workers
+        executor = executor or self.options.executor
+        if executor not in ('thread', 'process'):
+            raise ValueError('Executor must be "thread" or "process", found "{}"'.format(executor))
+        selected = [(date, filename) for date, filenames in self._select((dates, files)) for filename in filenames]
+        report = {}
+        saved = [time.time()]
+        def done(filename, status, seconds):
+            report[filename] = {'date': date_by_file[filename], 'status': status, 'seconds': seconds}
+            if status == 'warmed' and time.time() - saved[0] >= self.warm_save_interval:
+                CacheIndex.save_all()
+                saved[0] = time.time()
+            log.info('Warm {}/{}: {} {} in {:.1f}s'.format(len(report), len(selected), status, filename, seconds))
+            if progress: progress(len(report), len(selected), filename, status)
+        date_by_file = {filename: date for date, filename in selected}
+        todo = []
+        for date, filename in selected:
+            if self.cached(filename):
+                done(filename, 'cached', 0.0)
+            else:
+                todo.append(filename)
+        workers = min(workers or 1, len(todo))
+        if executor == 'process' and workers > 1:
+            CacheIndex.save_all()
+            store_pool.close_all()
+            pool = multiprocessing.Pool(workers, frame_worker_init, (multiprocessing.RLock(),))
+            try:
+                for filename, status, seconds, profile in pool.imap_unordered(frame_warm, [self._frame_args(f) for f in todo]):
+                    self._profile.extend(profile)
+                    done(filename, status, seconds)
+            finally:
+                pool.terminate()
+                pool.join()
+                CacheIndex.load_all()
+        elif workers > 1:
+            pool = ThreadPool(workers)
+            try:
+                for result in pool.imap_unordered(self._warm_file, todo):
+                    done(*result)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for filename in todo:
+                done(*self._warm_file(filename))
+        CacheIndex.save_all()
+        filenames = [filename for date, filename in selected]
+        return pd.DataFrame([report[filename] for filename in filenames], index=pd.Index(filenames, name='filename'), 
+                            columns=['date', 'status', 'seconds'])
+    def _warm_file(self, filename):
+        "Process the file for warm; return the filename, status and seconds."
+        start = time.time()
+        try:
+            self.from_file(filename)
+            status = 'warmed'
+        except Exception as e:
+            print e, filename
+            status = 'failed'
+        return filename, status, time.time() - start
+
+def frame_prepare(levels, metadata_root, name, filename, *processor_args):
+    "Return an empty dataframe with the metadata and processor for the file, ready for processing."
+    import  biz.pandas as bp
+    df = bp.DataFrame()
+    # Assign meta-data to dataframe, for identification of source etc.
+    df._biz_metadata.set(levels, metadata_root, name)
+    df._biz_processor.set(filename, *processor_args)
+    return df
+
+def frame_worker_init(lock):
+    "Initializer of the worker-processes of read_source.from_files: share the cache-files with the other processes."
+    store_pool.share(lock)
+
+def frame_process(args):
+    """Process a file in a worker-process, see read_source.from_files. Return the data (block manager) and the
+    profile of the dataframe, for the biz-attributes of a dataframe are not pickled."""
+    df = frame_prepare(*args)
+    df._biz_processor.process()
+    CacheIndex.save_all()  # A worker-process doesn't save at exit
+    return df._data, df._biz_processor.profile
+
+def frame_warm(args):
+    "Process a file in a worker-process for read_source.warm; return the filename, status, seconds and profile."
+    start = time.time()
+    try:
+        df = frame_prepare(*args)
+        df._biz_processor.process()
+        return args[3], 'warmed', time.time() - start, df._biz_processor.profile
+    except Exception as e:
+        print e, args[3]
+        return args[3], 'failed', time.time() - start, []
+    finally:
+        CacheIndex.save_all()  # A worker-process doesn't save at exit
+
+def test_benchmark_backends(filename=None, rows=1000000, path=None, **reader_kwargs):
+    """Compare store- and retrieve-latency and size on disk of the cache-backends, for the supplied delivery-extract
+    or for a generated extract with the typical columns of a delivery (ids, names, zipcodes, amounts, dates)."""
+    import tempfile, shutil, biz.pandas as bp
+    if filename:
+        df = pd.DataFrame(bp.read_file(filename, **reader_kwargs))
+    else:
+        names = np.array(['Jansen', 'de Vries', 'van den Berg', 'Bakker', 'Visser', 'Smit', 'Meijer', 'de Boer'])
+        df = pd.DataFrame({'id': np.arange(rows), 
+                           'name': names[np.random.randint(0, len(names), rows)],
+                           'zipcode': ['{:04d} {}{}'.format(i % 9000 + 1000, chr(65 + i % 26), chr(65 + i % 23)) for i in range(rows)],
+                           'amount': np.random.rand(rows) * 1000,
+                           'date': pd.Timestamp('2013-01-01') + pd.to_timedelta(np.random.randint(0, 365, rows), unit='D')})
+    path = path or tempfile.mkdtemp()
+    source = join(path, 'source.csv')
+    open(source, 'w').close()
+    try:
+        for backend in sorted(cache_backends):
+            cache = Cache(join(path, '{process}.h5'), backend, backend=backend)
+            t0 = time.time()
+            cache.store(source, df)
+            t1 = time.time()
+            df1 = cache.retrieve(source)
+            t2 = time.time()
+            store_pool.close_all()
+            print '{:10} store {:8.2f}s  retrieve {:8.2f}s  size {:8.1f}MB  rows {}'.format(
+                backend, t1 - t0, t2 - t1, cache.backend.size() / 2. ** 20, len(df1))
+    finally:
+        store_pool.close_all()
+        shutil.rmtree(path, ignore_errors=True)
+
+def _concurrent_writer(filename, sources, backend):
+    "Store a dataframe for every source in the cache, see test_concurrent_writers."
+    cache = Cache(filename, 'stress', backend=backend, compression='fast')
+    for source in sources:
+        cache.store(source, _concurrent_frame(source), hash=split(source)[1])
+
+def _concurrent_frame(source, rows=10000):
+    "Return the dataframe for the source, generated from its name so every process generates the same."
+    random = np.random.RandomState(int(hashlib.md5(source).hexdigest()[:8], 16))
+    return pd.DataFrame({'id': np.arange(rows), 'value': random.rand(rows), 'name': random.choice(['a', 'bb', 'ccc'], rows)})
+
+def test_concurrent_writers(writers=8, files=20, backend='hdf', path=None):
+    """Let several processes (not sharing a lock) store dataframes in one cache-file at the same time, then verify
+    that the cache-file is intact: every dataframe can be retrieved unchanged and is in the index."""
+    path = path or tempfile.mkdtemp()
+    filename = join(path, '{process}.h5')
+    sources = []
+    for i in range(writers * files):
+        sources.append(join(path, 'source{:04d}.csv'.format(i)))
+        open(sources[-1], 'w').close()
+    start = time.time()
+    processes = [multiprocessing.Process(target=_concurrent_writer, args=(filename, sources[i::writers], backend)) for i in range(writers)]
+    for process in processes: process.start()
+    for process in processes: process.join()
+    print '{} writers stored {} dataframes in {:.2f}s'.format(writers, len(sources), time.time() - start)
+    CacheIndex.load_all()
+    cache = Cache(filename, 'stress', backend=backend)
+    assert len(cache.keys()) == len(sources), (len(cache.keys()), len(sources))
+    for source in sources:
+        assert cache.present(source, hash=split(source)[1]), source
+        assert cache.retrieve(source, hash=split(source)[1]).equals(_concurrent_frame(source)), source
+    print 'All {} dataframes intact'.format(len(sources))
+    shutil.rmtree(path, ignore_errors=True)
+
+def test_chunked(key='2013-05', chunksize=100000, levels='/source/kpn/swol_marketing', pipeline=['input', 'map'], **options):
+    "Read the files in memory and in chunks (without and with the chunked caches) and check the results are identical."
+    def frames(src):
+        result = src[key]
+        return result if isinstance(result, dict) else {key: result}
+    expected = frames(read_source(levels=levels, pipeline=pipeline, from_cache=False, to_cache=False, **options))
+    for from_cache in False, True:
+        start = time.time()
+        found = frames(read_source(levels=levels, pipeline=pipeline, from_cache=from_cache, chunksize=chunksize, **options))
+        for name in expected:
+            assert pd.DataFrame(found[name]).equals(pd.DataFrame(expected[name])), name
+        print 'Chunked (from_cache={}): {} frames identical in {:.2f}s'.format(from_cache, len(expected), time.time() - start)
 
 def test_ip():
     import biz, pandas
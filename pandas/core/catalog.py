@@ -0,0 +1,168 @@
+import os, sys, json, time, logging, threading
+from os.path import join, split, isdir, exists
+from biz.pandas.core.utils import replace_file, mkdir, FileLock
+log = logging.getLogger('catalog')
+
+###############################################################################
+# This module contains the catalog of the data-tree: a persistent listing of all directories with their
+# subdirectories, files and the dates derived from their names. read_source walks the catalog instead of
+# the (network-)filesystem; only directories which changed since the last walk are listed again.
+###############################################################################
+
+def _str(item, encoding=sys.getfilesystemencoding() or 'utf-8'):
+    "Json returns unicode; return the paths as str in the filesystem-encoding, like os.listdir does for a str-path."
+    if isinstance(item, dict):
+        return {_str(k): _str(v) for k, v in item.items()}
+    if isinstance(item, list):
+        return [_str(v) for v in item]
+    if isinstance(item, unicode):
+        return item.encode(encoding)
+    return item
+
+class Catalog(object):
+    """Persistent, incrementally refreshed catalog of directory-trees, stored in a json-file (e.g. catalog.json
+    in the cache_root). Per directory the mtime, the subdirectories and files and the memoized dates of its
+    entries are stored. On every walk only the mtime of a directory is read; the directory is listed again
+    when its mtime changed, which happens when entries are added, removed or renamed.
+    CAVEAT: a file which is overwritten in place keeps its memoized date until its directory changes, call refresh.
+    The time it took to list a directory and compute the dates is kept, so the time saved by the catalog can be
+    reported: commit saves the catalog and logs the statistics since the previous commit.
+    The catalog is saved under its lock-file ({filename}.lock) and the directories changed by this process are merged
+    into the file, for other processes may open sources on the same catalog at the same time."""
+    _catalogs = {}
+    _catalogs_lock = threading.Lock()
+    def __init__(self, filename):
+        self.filename = filename
+        self.directories = {}  # Path: {mtime, dirnames, filenames, dates, cost}
+        self._changed = set()  # The paths listed, dated or forgotten since the last load or save
+        self._dirty = False
+        self._lock = threading.RLock()
+        self.load()
+        self.reset_stats()
+    @classmethod
+    def get(cls, filename):
+        "Return the catalog for the filename, loaded only once per process."
+        name = os.path.abspath(filename)
+        with cls._catalogs_lock:
+            if name not in cls._catalogs:
+                cls._catalogs[name] = cls(filename)
+            return cls._catalogs[name]
+    def _read(self):
+        "Return the directories in the file; empty when it is missing or corrupt."
+        if exists(self.filename):
+            try:
+                with open(self.filename) as f:
+                    return _str(json.load(f))
+            except ValueError as e:
+                print e  # Corrupt catalog, build it again
+        return {}
+    def load(self):
+        with self._lock:
+            self.directories = self._read()
+            self._changed.clear()
+            self._dirty = False
+    def save(self):
+        "Save the catalog, merged with the directories saved by others since it was loaded."
+        mkdir(self.filename)
+        with self._lock, FileLock.get(self.filename + '.lock'):
+            directories = self._read()
+            for path in self._changed:
+                if path in self.directories:
+                    directories[path] = self.directories[path]
+                else:
+                    directories.pop(path, None)
+            filename_tmp = '{}.{}.tmp'.format(self.filename, os.getpid())
+            with open(filename_tmp, 'w') as f:
+                json.dump(directories, f, encoding=sys.getfilesystemencoding() or 'utf-8')
+            replace_file(filename_tmp, self.filename)
+            self.directories = directories
+            self._changed.clear()
+            self._dirty = False
+    def refresh(self, path=None):
+        "Forget the directory and all its subdirectories (default all), so they are listed again on the next walk."
+        with self._lock:
+            for key in self.directories.keys():
+                if path is None or key == path or key.startswith(join(path, '')):
+                    del self.directories[key]
+                    self._changed.add(key)
+            self._dirty = True
+    def reset_stats(self):
+        self.stats = {'listed': 0, 'reused': 0, 'seconds': 0.0, 'seconds_saved': 0.0}
+    def directory(self, path):
+        "Return the entry of the directory, listed again when its mtime changed. Return None if it does not exist."
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        with self._lock:
+            entry = self.directories.get(path)
+            if entry is not None and entry['mtime'] == mtime:
+                self.stats['reused'] += 1
+                self.stats['seconds_saved'] += entry['cost']
+                return entry
+            start = time.time()
+            dirnames, filenames = [], []
+            for name in os.listdir(path):
+                (dirnames if isdir(join(path, name)) else filenames).append(name)
+            if entry is not None:
+                for name in set(entry['dirnames']) - set(dirnames):
+                    self.refresh(join(path, name))
+            dates = entry['dates'] if entry is not None else {}
+            entry = self.directories[path] = {'mtime': mtime, 'dirnames': dirnames, 'filenames': filenames,
+                                              'dates': {k: v for k, v in dates.items() if k in dirnames or k in filenames},
+                                              'cost': time.time() - start}
+            self.stats['listed'] += 1
+            self._changed.add(path)
+            self._dirty = True
+            return entry
+    def walk(self, top):
+        "Walk the tree top-down, like os.walk: yield the dirpath, dirnames and filenames of every directory."
+        start = time.time()
+        entry = self.directory(top)
+        self.stats['seconds'] += time.time() - start
+        if entry is None:
+            return
+        yield top, list(entry['dirnames']), list(entry['filenames'])
+        for name in entry['dirnames']:
+            for item in self.walk(join(top, name)):
+                yield item
+    def date(self, path, function):
+        """Return the date of the file or directory (e.g. collect.file_date), memoized in the entry of its
+        directory. The function must return a string or None."""
+        dirpath, name = split(path)
+        with self._lock:
+            entry = self.directories.get(dirpath)
+            if entry is None:
+                return function(path)
+            if name not in entry['dates']:
+                start = time.time()
+                entry['dates'][name] = function(path)
+                entry['cost'] += time.time() - start
+                self.stats['seconds'] += time.time() - start
+                self._changed.add(dirpath)
+                self._dirty = True
+            return entry['dates'][name]
+    def commit(self):
+        "Save the catalog if it changed; log and return the statistics since the previous commit."
+        stats = self.stats
+        if self._dirty:
+            self.save()
+        log.info('Catalog {}: {listed} directories listed, {reused} reused in {seconds:.2f}s, {seconds_saved:.2f}s saved'.format(
+                 self.filename, **stats))
+        self.reset_stats()
+        return stats
+
+def test_catalog(path=r"P:\data", filename=None):
+    "Walk the tree twice, with the catalog and with os.walk, and print the time of both."
+    filename = filename or join(os.environ.get('TEMP', '/tmp'), 'catalog.json')
+    catalog = Catalog.get(filename)
+    for i in range(2):
+        start = time.time()
+        n = sum([len(filenames) for dirpath, dirnames, filenames in catalog.walk(path)])
+        print 'Catalog walk {}: {} files in {:.2f}s'.format(i, n, time.time() - start), catalog.commit()
+    start = time.time()
+    n = sum([len(filenames) for dirpath, dirnames, filenames in os.walk(path)])
+    print 'os.walk: {} files in {:.2f}s'.format(n, time.time() - start)
+
+if __name__ == '__main__':
+    test_catalog()
@@ -1,10 +1,17 @@
 from __future__ import division
 import pandas as pd, numpy as np
-import sys, re, collections, os, os.path, importlib, weakref, copy
+import sys, re, collections, os, os.path, importlib, weakref, copy, time, types, hashlib, logging
+from multiprocessing.pool import ThreadPool
 from collections import defaultdict
 from isounidecode import unidecode
 from biz.pandas.tools.container import PrimusInterPares
 from biz.pandas.core.utils import mkdir
+try:
+    import resource
+except ImportError:
+    resource = None  # Not on Windows; no peak-memory in the profile
+
+log = logging.getLogger('frame')
 
 ###############################################################################
 # This module contains helper-functions which all work on a pandas DataFrame.
@@ -55,6 +62,59 @@ def kaplan_meier(survivors, deaths):
     df['factor'] = (df.remain - df.deaths) / df.remain
     return df.factor.fillna(1).cumprod()
 
+_flatten_memo = {}  # Flattened non-ascii strings, see flatten_strings
+
+def _flatten_uniques(uniques, flatten, memo_size=10 ** 6):
+    """Return the flattened distinct strings. When all strings are ascii (detected in bulk) they are returned as str, 
+    otherwise the non-ascii strings are flattened one by one, memoized over all calls. The memo is shared by the 
+    threads and may be cleared by another thread at any moment, so a flattened string is used from the local value."""
+    try:
+        u''.join(uniques).encode('ascii')
+        return np.array([str(u) for u in uniques], dtype=object)
+    except UnicodeError:
+        pass
+    if len(_flatten_memo) > memo_size:
+        _flatten_memo.clear()
+    result = np.empty(len(uniques), dtype=object)
+    for i, u in enumerate(uniques):
+        try:
+            result[i] = u.encode('ascii')
+        except UnicodeError:
+            flat = _flatten_memo.get(u)
+            if flat is None:
+                flat = _flatten_memo[u] = flatten(u)
+            result[i] = flat
+    return result
+
+def flatten_strings(df):
+    """Return the dataframe with all strings flattened to plain ascii, identical to df.applymap(_flatten) with _flatten
+    of biz.pipeline.source, but column-wise: per object-column the distinct values are determined once (factorize) 
+    and only the distinct non-ascii values are flattened. Columns with other values than strings and nulls are
+    mapped per value, for factorize takes e.g. 1, 1.0 and True as the same value. Datetime columns are mapped too,
+    so they become object columns of Timestamps, like applymap returns them."""
+    from biz.pipeline.source import _flatten
+    columns = []
+    for i in range(len(df.columns)):
+        series = df.iloc[:, i]
+        values = series.values
+        if values.dtype.kind == 'M':
+            columns.append(series.map(_flatten).values)  # Boxed to Timestamps as by applymap
+            continue
+        if values.dtype != object:
+            columns.append(values)
+            continue
+        codes, uniques = pd.factorize(values)
+        if not len(uniques) or not all([isinstance(u, basestring) for u in uniques]):
+            columns.append(series.map(_flatten).values)
+            continue
+        flattened = _flatten_uniques(uniques, _flatten).take(codes)
+        missing = codes == -1
+        flattened[missing] = values[missing]  # Keep the original nulls (None or NaN)
+        columns.append(flattened)
+    result = pd.DataFrame(dict(zip(range(len(columns)), columns)), index=df.index, columns=range(len(columns)))
+    result.columns = df.columns
+    return result
+
 class PipelineProcess(object):
     def __init__(self, modulenames=['biz.pipeline']):
         "Get all processes from the selected modules. "
@@ -73,78 +133,506 @@ class PipelineProcess(object):
         return self.functions[n](df) if n in self.functions else None        
     def changed(self, name, df):
         return self(name, df, '_changed')
+    def code_hash(self, name):
+        "Return a hash of the code and constants of the function, so a changed function gives another hash."
+        def update(h, code):
+            h.update(code.co_code)
+            for const in code.co_consts:
+                if isinstance(const, types.CodeType):
+                    update(h, const)  # Nested function; its repr contains an address
+                else:
+                    h.update(repr(const))
+        h = hashlib.md5()
+        update(h, self.functions[name].func_code)
+        return h.hexdigest()
     def hash(self, name, df):
         return self(name, df, '_hash')
+    def attrs(self, name, df):
+        return self(name, df, '_attrs')
+    def sample(self, name, df):
+        return self(name, df, '_sample')
+
+StepPlan = collections.namedtuple('StepPlan', ['step', 'status', 'action', 'hash'])
+
+def dag_normalize(dag):
+    """Return the DAG-pipeline {node: parents} with the parents as tuple; a parent can be given as name, list or
+    None (for a source-node like 'input')."""
+    return {node: tuple([parents] if isinstance(parents, basestring) else parents or []) for node, parents in dag.items()}
+
+def dag_order(dag):
+    "Return the nodes of the DAG in topological order (parents first, ties by name). Raise ValueError on a cycle."
+    order, done, busy = [], set(), set()
+    def visit(node):
+        if node in done: return
+        if node in busy:
+            raise ValueError('Cycle in pipeline at "{}"'.format(node))
+        if node not in dag:
+            raise ValueError('Parent "{}" is not a node of the pipeline'.format(node))
+        busy.add(node)
+        for parent in dag[node]:
+            visit(parent)
+        busy.discard(node)
+        done.add(node)
+        order.append(node)
+    for node in sorted(dag):
+        visit(node)
+    return order
+
+def peak_rss():
+    "Return the peak resident memory of the process in bytes, or None when it is not available."
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+def cpu_time():
+    "Return the user- and system-time of the process in seconds."
+    t = os.times()
+    return t[0] + t[1]
 
 class DataframeProcessor(PrimusInterPares):
     """Processor for dataframe which is read from source. Contains all metadata about the dataframe and
     can perform all necessary tasks for 'working up' dataframe to a usable format. """
     pipeline_process = PipelineProcess()
+    dag_workers = 4  # Threads for executing independent nodes of a DAG-pipeline in parallel
+    chunked_steps = set(['input', 'map'])  # Steps which work row by row, so they can be computed in chunks
+    chunk_sample_rows = 10000  # Minimum number of rows of the sample of a chunked file, see _chunk_sample
+    _caches = {}  # The Cache-objects by file_cache, step and cache_kwargs, see cache
     def __init__(self, df):
         super(DataframeProcessor, self).__init__()
         self.df = weakref.ref(df)  # Store weak ref to enable deletion of container dataframe
         self.dirty = defaultdict(lambda: True)  # Indicates if the specified process is dirty. Set by calling process.
         # The default value for dirty is True,so it is the responsibility of the caller to set it False, if appropriate.
         self.pipeline = []
+        self.dag = None  # {node: parents} for a DAG-pipeline; pipeline contains its nodes in topological order
         self.filename = None
         self.reader_kwargs = None
         self.file_cache = None
         self.from_cache = None
         self.to_cache = None
-    def copy(self):
-        return copy.copy(self)
+        self.cache_kwargs = {}
+        self.columns = None
+        self.where = None
+        self.chunksize = None
+        self.chunk = None  # The rows of the chunk which is computed (the raw rows for input), see _process_chunks
+        self.chunk_state = {}  # The result of the _sample-hook by step, while computing in chunks
+        self.last_plan = None
+        self.profile = []
+        self.materialized = 0  # The number of leading pipeline-steps whose result is the data of the dataframe
+    def copy(self, df=None):
+        """Return a copy for the dataframe (default the same dataframe). The pipeline is copied, so adding steps
+        to the copy doesn't change this processor."""
+        result = copy.copy(self)
+        result.pipeline = list(self.pipeline)
+        result.profile = list(self.profile)
+        if df is not None:
+            result.df = weakref.ref(df)
+        return result
     def pip_id(self):
         return self.filename
     def assume(self, other):
         assert isinstance(other, DataframeProcessor)
-        self.set(other.filename, other.reader_kwargs, other.pipeline, other.file_cache, other.from_cache, other.to_cache)
-    def set(self, filename, reader_kwargs, pipeline, file_cache, from_cache=True, to_cache=True):
+        self.set(other.filename, other.reader_kwargs, other.pipeline, other.file_cache, other.from_cache, other.to_cache, other.cache_kwargs,
+                 other.columns, other.where, other.chunksize)
+    def set(self, filename, reader_kwargs, pipeline, file_cache, from_cache=True, to_cache=True, cache_kwargs=None, columns=None, where=None,
+            chunksize=None):
         self.filename = filename
         self.reader_kwargs = reader_kwargs
         self.add_pipeline(pipeline)
         self.file_cache = file_cache
         self.from_cache = from_cache
         self.to_cache = to_cache
+        self.cache_kwargs = cache_kwargs or {}
+        self.columns = columns
+        self.where = where
+        self.chunksize = chunksize
         self.add(self)
     def add_pipeline(self, pipeline, skip_double=True):
         """Add all steps in the supplied pipeline to the current pipeline.
         If skip_double, the steps which are already present are skipped so each 
-        step is only executed once"""
-        self.pipeline += [s for s in pipeline if s not in self.pipeline] if skip_double else pipeline
-    def process(self):
-        # ToDo: step until first dirty step, or last step. The get df from cache!
+        step is only executed once.
+        A pipeline can also be a DAG: a dict with the parents by node, e.g. {'input': None, 'map': 'input', 
+        'zipcode': 'map', 'valid': 'map', 'report': ['zipcode', 'valid']}. A node gets the dataframe of its parent,
+        or the columns of all its parents concatenated. The result is the dataframe of the node without children,
+        or the columns of these nodes concatenated. Node-functions must not change their input in place, for
+        other nodes may get the same dataframe."""
+        if isinstance(pipeline, dict):
+            if self.pipeline and not self.dag:
+                raise ValueError("A DAG-pipeline can't be added to a linear pipeline")
+            self.dag = dict(self.dag or {}, **dag_normalize(pipeline))
+            self.pipeline = dag_order(self.dag)
+        elif self.dag and pipeline:
+            raise ValueError("A linear pipeline can't be added to a DAG-pipeline")
+        else:
+            self.pipeline += [s for s in pipeline if s not in self.pipeline] if skip_double else pipeline
+    def cache(self, step):
+        """Return the cache of the step. The Cache-objects are shared by all processors with the same settings, so
+        a cache-file is looked up once per process; removing cache-files of a running process is not supported."""
         from biz.pandas import Cache
-        if self.df() is None: return  # weak ref returned when calling it. Exit when no longer present.
+        key = (self.file_cache, step, repr(sorted(self.cache_kwargs.items())))
+        if key not in self._caches:
+            self._caches[key] = Cache(self.file_cache, step, **self.cache_kwargs)
+        return self._caches[key]
+    def plan(self, record=True):
+        """Return the plan for processing the pipeline: a StepPlan(step, status, action, hash) per step.
+        The status of a step is 'hit' when its cache is valid, 'miss' when it is not in the cache and 'stale' when
+        the cached data is outdated: other file-attributes or hash, or the _changed-hook returns True.
+        Only the deepest hit without a stale step before it is retrieved (action 'retrieve'); the steps before it
+        are skipped ('skip') and the steps after it are computed ('compute'), for their input changes.
+        A missing step before the deepest hit (e.g. evicted) doesn't matter, for the hit has the same file and hash.
+        When the data of the dataframe is the result of a later step (see materialized), that step gets the action
+        'memory' instead: the data in memory is used and the steps before it are skipped.
+        The hashes are computed before any data is loaded, on the dataframe with metadata only.
+        For a DAG-pipeline, the hash of a node also contains the hash of the code of its function and the hashes of 
+        its parents, so a changed node invalidates only its descendants. A node without children is retrieved when 
+        it is a hit and computed otherwise; a computed node needs its parents, by the same rule. Other nodes are 
+        skipped.
+        With record False the lookups are not registered as hits or misses of the caches (see Cache.valid)."""
         df = self.df()
-        prev_step = None
-        prev_cache = None
-        broken = False
+        statuses = []
+        hashes = {}
         for step in self.pipeline:
-            # Get from cache if present; read from file if:
-            # - file different from cache
-            # - function changed
-            # - Special function present with same name as process, suffixed by _changed
-            cache = Cache(self.file_cache, step)
+            cache = self.cache(step)
             hash = self.pipeline_process.hash(step, df)
-            if not self.from_cache or not cache.present(self.filename, hash=hash, **self.reader_kwargs) or \
-               self.pipeline_process.changed(step, df) or broken:
-                if not broken and prev_cache:
-                    # Data must be retrieved; get previous data if present:
-                    df._data = prev_cache.retrieve(self.filename,  hash=prev_hash, **self.reader_kwargs)._data
+            if self.dag is not None:
+                h = hashlib.md5(str(hash))
+                h.update(self.pipeline_process.code_hash(step))
+                for parent in self.dag[step]:
+                    h.update(hashes[parent])
+                hash = hashes[step] = h.hexdigest()
+            if not self.from_cache:
+                status = 'miss'
+            elif (cache.present if record else cache.valid)(self.filename, hash=hash, **self.reader_kwargs) \
+                    and not self.pipeline_process.changed(step, df):
+                status = 'hit'
+            elif cache.index.lookup(cache.key_from_filename(self.filename, **self.reader_kwargs)) is None:
+                status = 'miss'
+            else:
+                status = 'stale'
+            statuses.append((step, status, hash))
+        if self.dag is not None:
+            actions = {}
+            by_node = {step: status for step, status, hash in statuses}
+            def need(node):
+                if node in actions: return
+                actions[node] = 'retrieve' if by_node[node] == 'hit' else 'compute'
+                if actions[node] == 'compute':
+                    for parent in self.dag[node]:
+                        need(parent)
+            for node in self.dag_sinks():
+                need(node)
+            return [StepPlan(step, status, actions.get(step, 'skip'), hash) for step, status, hash in statuses]
+        deepest = -1
+        for i, (step, status, hash) in enumerate(statuses):
+            if status == 'stale': break
+            if status == 'hit': deepest = i
+        if self.materialized and self.materialized - 1 >= deepest:
+            # The result of a later step is in memory already, e.g. when processing further steps on a processed
+            # dataframe: continue from the data in memory instead of retrieving or computing it again.
+            return [StepPlan(step, status, 'skip' if i < self.materialized - 1 else 'memory' if i == self.materialized - 1 else 'compute', hash)
+                    for i, (step, status, hash) in enumerate(statuses)]
+        return [StepPlan(step, status, 'skip' if i < deepest else 'retrieve' if i == deepest else 'compute', hash)
+                for i, (step, status, hash) in enumerate(statuses)]
+    def stale(self, step):
+        """Return the outdated cached dataframe and general attrs of the step while it is computed, for reusing its
+        unchanged parts (see Metadata.map), or None. Only when no earlier step is stale, for then the input of the 
+        step may have changed too."""
+        if not self.from_cache or not self.last_plan or step not in self.pipeline:
+            return None
+        if any([p.status == 'stale' for p in self.last_plan[:self.pipeline.index(step)]]):
+            return None
+        return self.cache(step).stale(self.filename, **self.reader_kwargs)
+    def dag_sinks(self):
+        "Return the nodes of the DAG-pipeline without children, in topological order."
+        parents = set([parent for node in self.dag for parent in self.dag[node]])
+        return [node for node in self.pipeline if node not in parents]
+    def process(self):
+        """Process the pipeline according to its plan (see plan): retrieve the deepest valid step from its cache
+        and compute and store the steps after it. The executed plan is kept in last_plan.
+        The independent nodes of a DAG-pipeline are executed in parallel by dag_workers threads.
+        With a chunksize, the leading computed steps of a linear pipeline are computed in chunks of rows, see
+        _process_chunks.
+        Per step the profile gets a record with the filename, step, status, action, wall-time, cpu-time (of the 
+        process, so including other threads), the wall-time of storing in the cache, the increase of the peak
+        memory (peak_rss) and the number of rows and columns. The planning is recorded as step 'plan'.
+        When a step to retrieve is not in its cache anymore (e.g. evicted by another process since the plan, see 
+        Cache.retrieve), the pipeline is planned and processed again."""
+        from biz.pandas.core.cache import frame_select, CacheMiss
+        if self.df() is None: return  # weak ref returned when calling it. Exit when no longer present.
+        df = self.df()
+        self.profile = []
+        def record(step, status, action, wall, cpu, rss, store=0.0, frame=df, rows=None):
+            rss1 = peak_rss()
+            self.profile.append({'filename': self.filename, 'step': step, 'status': status, 'action': action, 
+                                 'wall': time.time() - wall, 'cpu': cpu_time() - cpu, 'store': store,
+                                 'rss_delta': rss1 - rss if rss1 is not None else None, 
+                                 'rows': len(frame) if rows is None else rows, 'columns': len(frame.columns)})
+        wall, cpu, rss = time.time(), cpu_time(), peak_rss()
+        self.last_plan = self.plan()
+        record('plan', None, None, wall, cpu, rss)
+        if self.dag is not None:
+            try:
+                df._data = self._process_dag(df, record)._data
+            except CacheMiss:
+                return self.process()
+            if self.columns is not None or self.where is not None:
+                df._data = frame_select(df, self.columns, self.where)._data
+            self.materialized = 0  # The data is the combination of the sinks, not of a step
+            self.df()._data = df._data
+            self.df()._clear_item_cache()
+            return
+        chunked, selected = self._process_chunks(df, record) if self.chunksize else (0, False)
+        for i, (step, status, action, hash) in enumerate(self.last_plan):
+            if i < chunked: continue
+            wall, cpu, rss, store = time.time(), cpu_time(), peak_rss(), 0.0
+            if action == 'retrieve':
+                # Only the selected columns and rows are read when it is the last step:
+                last = i == len(self.last_plan) - 1
+                try:
+                    df._data = self.cache(step).retrieve(self.filename, hash=hash, columns=self.columns if last else None, 
+                                                         where=self.where if last else None, **self.reader_kwargs)._data
+                except CacheMiss:
+                    return self.process()  # Not a hit in the plan anymore
+            elif action == 'compute':
                 df._data = self.pipeline_process.process(step, df)._data
                 hash = self.pipeline_process.hash(step, df)
+                cache = self.cache(step)
                 if self.to_cache and not cache.present(self.filename, hash=hash, **self.reader_kwargs):
-                    cache.store(self.filename, df, hash=hash, **self.reader_kwargs)
-                broken = True
-            prev_step = step
-            prev_cache = cache
-            prev_hash = hash
-        if not broken and prev_cache:
-            # Data must be retrieved; get previous data if present:
-            df._data = prev_cache.retrieve(self.filename,  hash=prev_hash, **self.reader_kwargs)._data
+                    store = time.time()
+                    cache.store(self.filename, df, hash=hash, attrs=self.pipeline_process.attrs(step, df), **self.reader_kwargs)
+                    store = time.time() - store
+            record(step, status, action, wall, cpu, rss, store)
+        if not selected and self.last_plan and self.last_plan[-1].action == 'compute' and (self.columns is not None or self.where is not None):
+            df._data = frame_select(df, self.columns, self.where)._data
+        # A selection of columns or rows is not the result of the steps; it can't be continued from:
+        self.materialized = len(self.pipeline) if self.columns is None and self.where is None else 0
         # Now assign the data to the container and reset the cache:
         self.df()._data = df._data
         self.df()._clear_item_cache()
+    def _chunk_frame(self, df, data=None):
+        "Return a biz dataframe on the data (default empty) with the metadata of the dataframe and this processor."
+        frame = DataFrame(data.copy(deep=False) if data is not None else None)
+        frame._biz_metadata, frame._biz_processor = df._biz_metadata, self
+        return frame
+    def _read_chunks(self):
+        """Return an iterator over the raw chunks of rows of the file, or None when the reader of the file does not
+        support a chunksize (only csv and txt do). The index runs on over the chunks, like for the complete file."""
+        import biz.pandas as bp
+        try:
+            reader = bp.read_file(self.filename, chunksize=self.chunksize, **self.reader_kwargs)
+        except TypeError:
+            return None
+        return reader if reader is not None and not isinstance(reader, pd.DataFrame) else None
+    def _chunk_sample(self, chunks):
+        """Return a sample of the rows of the chunks, evenly spread over them: every stride-th row, where the stride
+        is doubled (and the sample halved) whenever the sample exceeds twice chunk_sample_rows."""
+        from biz.pandas.tools.merge import concat
+        sample, positions, stride, offset = None, np.array([], dtype=np.int64), 1, 0
+        for chunk in chunks:
+            position = np.arange(offset, offset + len(chunk))
+            offset += len(chunk)
+            keep = position % stride == 0
+            sample = chunk[keep] if sample is None else concat([sample, chunk[keep]])
+            positions = np.concatenate([positions, position[keep]])
+            while len(sample) > 2 * self.chunk_sample_rows:
+                stride *= 2
+                keep = positions % stride == 0
+                sample, positions = sample[keep], positions[keep]
+        return sample
+    @staticmethod
+    def _chunk_dtypes(df):
+        """Return the dtypes by column for storing the dataframe in chunks: an int-column gets float and a bool-column
+        object, for another chunk may have missing values. A column with only missing values gets no dtype yet."""
+        result = {}
+        for i, name in enumerate(df.columns):
+            values = df.iloc[:, i]
+            if values.dtype.kind in 'iu':
+                result[name] = np.dtype(float)
+            elif values.dtype.kind == 'b':
+                result[name] = np.dtype(object)
+            elif values.dtype != object or values.notnull().any():
+                result[name] = values.dtype
+        return result
+    def _chunk_coerce(self, df, dtypes):
+        """Return the chunk with its columns converted to the dtypes (by column, see _chunk_dtypes), for the columns
+        of a table in the cache have one dtype for all chunks. The dtypes of the columns which have none yet are
+        added from the chunk. Raise ValueError when a column can't be converted, e.g. strings to float."""
+        for name, dtype in self._chunk_dtypes(df).items():
+            dtypes.setdefault(name, dtype)
+        converted = {}
+        for i, name in enumerate(df.columns):
+            if name in dtypes and df.iloc[:, i].dtype != dtypes[name]:
+                try:
+                    converted[name] = df.iloc[:, i].astype(dtypes[name])
+                except (ValueError, TypeError) as e:
+                    raise ValueError('Column "{}" of a chunk of "{}" can\'t be converted to {}: {}'.format(name, self.filename, dtypes[name], e))
+        if not converted:
+            return df
+        df = df.copy()
+        for name, values in converted.items():
+            df[name] = values
+        return df
+    def _process_chunks(self, df, record):
+        """Compute the leading steps of the plan which are computed and in chunked_steps (starting with 'input') in
+        chunks of chunksize rows, for a file which doesn't fit in memory. Every chunk is read, computed by all these 
+        steps and appended to their caches; only the last chunk gives the cached result its hash, so a partially 
+        stored result is never a hit. The dtypes of the columns of a step are fixed on its first chunk or its result 
+        for the sample, and every chunk is converted to them (see _chunk_coerce), for the columns of the cached table
+        have one dtype; an int-column is stored as float. Steps with a _sample-hook (e.g. map: the type-detection) get it called once
+        on a sample of at least chunk_sample_rows rows, evenly spread over the whole file (see _chunk_sample), 
+        before their chunks are computed; the result is kept in chunk_state, so all chunks get the same types and 
+        names. The steps before the first of these steps are computed on all chunks first; the sample is taken of 
+        their results. The steps from the first sampled step on continue from the cache of the step before, in 
+        chunks, so the file is read once; without that cache (e.g. without to_cache) the file is read again.
+        The result of the last chunked step is retrieved from its cache, with the columns and where when it is the 
+        last step of the pipeline, so only the selection needs to fit in memory. Without to_cache the chunks are
+        concatenated in memory.
+        Return the number of chunked steps and whether the columns and where are applied. Return (0, False) when 
+        the steps can't be chunked, e.g. for an excel-file, or the result could not be stored; they are computed in
+        memory then, with a warning for the latter."""
+        from biz.pandas.tools.merge import concat
+        steps = []
+        for p in self.last_plan:
+            if p.action != 'compute' or p.step not in self.chunked_steps: break
+            steps.append(p)
+        if not steps or steps[0].step != 'input':
+            return 0, False
+        reader = self._read_chunks()
+        if reader is None:
+            return 0, False
+        readers = [reader]
+        samplers = [p.step for p in steps if p.step + '_sample' in self.pipeline_process.functions]
+        caches = {p.step: self.cache(p.step) for p in steps} if self.to_cache else {}
+        storing = set(caches)
+        totals = dict([(p.step, {'wall': 0.0, 'cpu': 0.0, 'store': 0.0, 'rows': 0}) for p in steps])
+        rss = peak_rss()
+        frames, hashes, computed, dtypes = [], {}, [0], defaultdict(dict)
+        def frame_of(chunk, step):
+            "Return the frame for computing the step on the chunk: 'input' reads the raw rows from self.chunk."
+            self.chunk = chunk
+            return self._chunk_frame(df, None if step == 'input' else chunk._data)
+        def run(steps, chunks, again=False):
+            """Compute the steps on the chunks (the raw rows, or the results of the step before the steps) and store
+            the results; yield the result of the last step per chunk. Computing again, nothing is stored or counted."""
+            chunk, i = next(chunks, None), 0
+            while chunk is not None:
+                following = next(chunks, None)  # Look ahead, for the last chunk completes the cached results
+                frame = frame_of(chunk, steps[0].step)
+                for p in steps:
+                    wall, cpu = time.time(), cpu_time()
+                    frame = self._chunk_frame(df, self.pipeline_process.process(p.step, frame)._data)
+                    if p.step in storing and not again:
+                        frame = self._chunk_frame(df, self._chunk_coerce(frame, dtypes[p.step])._data)
+                        store = time.time()
+                        hash = hashes[p.step] = self.pipeline_process.hash(p.step, frame) if following is None else caches[p.step].partial
+                        if not caches[p.step].store(self.filename, frame, hash=hash, attrs=self.pipeline_process.attrs(p.step, frame),
+                                                    chunk=i, **self.reader_kwargs):
+                            log.warning('Chunk {} of step "{}" of "{}" could not be stored'.format(i, p.step, self.filename))
+                            storing.discard(p.step)
+                        totals[p.step]['store'] += time.time() - store
+                    totals[p.step]['wall'] += time.time() - wall
+                    totals[p.step]['cpu'] += cpu_time() - cpu
+                    if not again: totals[p.step]['rows'] += len(frame)
+                computed[0] = max(computed[0], i + 1)
+                yield frame
+                chunk, i = following, i + 1
+        try:
+            self.chunk_state = {}
+            chunks = iter(reader)
+            before, after = [], steps  # The steps before the first step with a _sample-hook, and the others
+            frame = self._chunk_frame(df)
+            if samplers:
+                first = [p.step for p in steps].index(samplers[0])
+                before, after = steps[:first], steps[first:]
+                sample = self._chunk_sample(run(before, chunks) if before else chunks)
+                if sample is not None:
+                    frame = frame_of(sample, after[0].step)
+                    for p in after:
+                        wall, cpu = time.time(), cpu_time()
+                        if p.step in samplers:
+                            self.chunk_state[p.step] = self.pipeline_process.sample(p.step, frame)
+                        frame = self._chunk_frame(df, self.pipeline_process.process(p.step, frame)._data)
+                        dtypes[p.step] = self._chunk_dtypes(frame)
+                        totals[p.step]['wall'] += time.time() - wall
+                        totals[p.step]['cpu'] += cpu_time() - cpu
+                    sample = None
+                if before and before[-1].step in storing:
+                    chunks = caches[before[-1].step].iterate(self.filename, hash=hashes[before[-1].step], 
+                                                             chunksize=self.chunksize, **self.reader_kwargs)
+                else:
+                    # The results of the steps before aren't cached, so the file is read and computed again:
+                    reader = self._read_chunks()
+                    readers.append(reader)
+                    chunks = run(before, iter(reader), again=True) if before else iter(reader)
+            for frame in run(after, chunks):
+                if steps[-1].step not in caches:
+                    frames.append(frame)
+        finally:
+            self.chunk, self.chunk_state = None, {}
+            for reader in readers:
+                if hasattr(reader, 'close'): reader.close()
+        last = steps[-1]
+        if not computed[0]:
+            return 0, False  # Empty file
+        if last.step in caches and last.step not in storing:
+            log.warning('The chunks of step "{}" of "{}" could not be stored; the file is computed in memory'.format(last.step, self.filename))
+            return 0, False
+        for p in steps:
+            record(p.step, p.status, p.action, time.time() - totals[p.step]['wall'], cpu_time() - totals[p.step]['cpu'], rss,
+                   totals[p.step]['store'], frame, totals[p.step]['rows'])
+        if last.step in caches:
+            selected = len(steps) == len(self.pipeline)
+            df._data = caches[last.step].retrieve(self.filename, hash=hashes[last.step], 
+                                                  columns=self.columns if selected else None, 
+                                                  where=self.where if selected else None, **self.reader_kwargs)._data
+            return len(steps), selected
+        df._data = (concat(frames) if frames else pd.DataFrame())._data
+        return len(steps), False
+    def _process_dag(self, df, record):
+        """Execute the plan of the DAG-pipeline, level by level: the nodes of a level only depend on nodes of
+        lower levels and are executed in parallel. Return the (concatenated) dataframe of the nodes without children."""
+        from biz.pandas.tools.merge import concat
+        plan = {p.step: p for p in self.last_plan}
+        frames = {}
+        def combine(nodes):
+            "Return the dataframe of the nodes; the columns of several nodes are concatenated, the first one wins."
+            if not nodes:
+                return pd.DataFrame(index=df.index)
+            if len(nodes) == 1:
+                return frames[nodes[0]]
+            result = concat([frames[node] for node in nodes], axis=1)
+            return result.loc[:, ~pd.Series(result.columns).duplicated().values]
+        def run(node):
+            wall, cpu, rss, store = time.time(), cpu_time(), peak_rss(), 0.0
+            step, status, action, hash = plan[node]
+            if action == 'retrieve':
+                frames[node] = self.cache(node).retrieve(self.filename, hash=hash, **self.reader_kwargs)
+            else:
+                frame = DataFrame(combine(self.dag[node])._data.copy(deep=False))
+                frame._biz_metadata, frame._biz_processor = df._biz_metadata, self
+                frames[node] = self.pipeline_process.process(node, frame)
+                cache = self.cache(node)
+                if self.to_cache and not cache.present(self.filename, hash=hash, **self.reader_kwargs):
+                    store = time.time()
+                    cache.store(self.filename, frames[node], hash=hash, attrs=self.pipeline_process.attrs(node, frame), **self.reader_kwargs)
+                    store = time.time() - store
+            record(node, status, action, wall, cpu, rss, store, frames[node])
+        levels = {}
+        for node in self.pipeline:
+            levels[node] = 1 + max([levels[parent] for parent in self.dag[node]] or [-1])
+        pool = None
+        try:
+            for level in range(max(levels.values()) + 1 if levels else 0):
+                nodes = [node for node in self.pipeline if levels[node] == level and plan[node].action != 'skip']
+                if len(nodes) > 1 and self.dag_workers > 1:
+                    pool = pool or ThreadPool(self.dag_workers)
+                    pool.map(run, nodes, chunksize=1)
+                else:
+                    map(run, nodes)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return combine(self.dag_sinks())
 
 class DataFrame(pd.DataFrame):
     def __init__(self, data=None, index=None, columns=None, dtype=None, copy=False):
@@ -154,20 +642,25 @@ class DataFrame(pd.DataFrame):
         super(DataFrame, self).__init__(data, index, columns, dtype, copy)
         self._biz_processor = DataframeProcessor(self)
         self._biz_metadata = Metadata()
-    def copy(self):
-        df = DataFrame(self._data)
+    def copy(self, deep=True):
+        """Return a copy with a copy of the metadata and processor. With deep=False the arrays of the data are
+        shared: adding, replacing or removing columns of the copy doesn't change this dataframe, changing values 
+        in place does."""
+        df = DataFrame(self._data.copy(deep=deep))
         df._biz_metadata = self._biz_metadata.copy()
-        df._biz_processor = self._biz_processor.copy()
+        df._biz_processor = self._biz_processor.copy(df)
         return df
     def assume_metadata(self, other):
         self._biz_metadata = other._biz_metadata.copy()
-        self._biz_processor = other._biz_processor.copy()
+        self._biz_processor = other._biz_processor.copy(self)
+        self._biz_processor.materialized = 0  # Other data than the result of the steps of other
         return self
     __new__ = object.__new__  # Instantiate parent-object of parent-object, because parent-object instantiates this class. object is first class with __new__ method; other ancestors don't define it.
     def _biz_process(self, *args, **kwargs):
         """Apply the supplied function(s) to the dataframe. The function(s) are specified as separate args and
-        executed in the specified order."""
-        df = self.copy()
+        executed in the specified order. The result shares the arrays of this dataframe: the steps are continued
+        from the data in memory (see DataframeProcessor.plan) and produce new arrays, so nothing is copied."""
+        df = self.copy(deep=False)
         df._biz_processor.add_pipeline(args, False)
         df._biz_processor.process()
         return df
@@ -195,6 +688,107 @@ def test_clean():
     clean_column_names(df)
     print df.columns
     assert max(collections.Counter(df.columns).values()) == 1
+
+
+def test_flatten_strings(rows=1000000, columns=40, repeat=3):
+    """Compare flatten_strings with applymap(_flatten) on a dataframe with strings (mostly ascii), numbers, dates and
+    nulls. Print the time of both and assert that the results are identical."""
+    import time
+    from biz.pipeline.source import _flatten
+    values = np.array(['Amsterdam', 'Rotterdam', u'K\xf6ln', 'Utrecht', u'Li\xe8ge', np.nan, 'Den Haag', '1234 AB'], dtype=object)
+    data = {'c{}'.format(i): values.take(np.random.randint(0, len(values), rows)) for i in range(columns - 3)}
+    data['number'] = np.arange(rows)
+    data['date'] = pd.date_range('2000-01-01', periods=rows, freq='min')
+    data['mixed'] = np.array([1, 1.0, True, 'a', None], dtype=object).take(np.random.randint(0, 5, rows))
+    df = pd.DataFrame(data)
+    for name, function in (('applymap', lambda df: df.applymap(_flatten)), ('flatten_strings', flatten_strings)):
+        start = time.time()
+        for i in range(repeat):
+            result = function(df)
+        print '{}: {:.2f}s'.format(name, (time.time() - start) / repeat)
+    expected = df.applymap(_flatten)
+    assert (result.dtypes == expected.dtypes).all()
+    assert result.equals(expected)
+    assert all([[type(v) for v in result[c]] == [type(v) for v in expected[c]] for c in result.columns])
+
+def _process_memory(rows, steps, reuse, cached=False):
+    """Chain steps on a large dataframe, each adding a column, and return the increase of the peak memory in MB and
+    the number of steps retrieved from the cache. Without reuse, every call copies the dataframe and computes all 
+    steps again, like before the steps were continued from the data in memory. When cached, every step is stored 
+    in the cache, so the steps before a new step are hits; with reuse they are still not retrieved."""
+    import tempfile
+    def add_column(i):
+        def step(df):
+            result = DataFrame(df._data.copy(deep=False))
+            result['s{}'.format(i)] = df.iloc[:, 0] * i
+            return result
+        return step
+    names = ['_memory{}'.format(i) for i in range(steps)]
+    for i, name in enumerate(names):
+        DataframeProcessor.pipeline_process.functions[name] = add_column(i)
+    df = DataFrame({'a': np.random.rand(rows), 'b': np.random.rand(rows), 'c': np.arange(rows)})
+    path = tempfile.mkdtemp()
+    filename = os.path.join(path, 'memory.csv')
+    open(filename, 'w').close()  # The cache-key and stat of the steps
+    df._biz_processor.set(filename, {}, [], os.path.join(path, '{process}.h5'), from_cache=cached, to_cache=cached,
+                          cache_kwargs={'backend': 'columnar'})
+    rss = peak_rss()
+    retrieved = 0
+    for name in names:
+        if reuse:
+            df = df(name)
+        else:
+            df = df.copy()
+            df._biz_processor.materialized = 0
+            df._biz_processor.add_pipeline([name], False)
+            df._biz_processor.process()
+        retrieved += len([p for p in df._biz_processor.last_plan if p.action == 'retrieve'])
+    return round((peak_rss() - rss) / 2 ** 20) if rss is not None else None, retrieved  # No peak memory on Windows
+
+def test_process_memory(rows=10000000, steps=4):
+    """Measure the increase of the peak memory of chaining steps on a large dataframe, with and without continuing 
+    from the data in memory, without and with caching the steps. Every measurement runs in a fresh process, for 
+    the peak memory never decreases. With reuse, no step is retrieved from the cache."""
+    import multiprocessing
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        for cached in False, True:
+            for reuse in False, True:
+                mb, retrieved = pool.apply(_process_memory, (rows, steps, reuse, cached))
+                print 'Cached {}, reuse {}: peak memory increased {} MB, {} steps retrieved'.format(cached, reuse, mb, retrieved)
+                if reuse:
+                    assert retrieved == 0, retrieved
+    finally:
+        pool.close()
+        pool.join()
+
+def test_chunk_sample(rows=1000000, chunksize=100000):
+    "Check the sample of a chunked file is evenly spread over the whole file, not taken from its head."
+    df = pd.DataFrame()
+    processor = DataframeProcessor(df)
+    chunks = (pd.DataFrame({'row': np.arange(start, min(start + chunksize, rows))}) for start in range(0, rows, chunksize))
+    sample = processor._chunk_sample(chunks)
+    assert processor.chunk_sample_rows <= len(sample) <= 2 * processor.chunk_sample_rows, len(sample)
+    strides = np.unique(np.diff(sample.row.values))
+    assert len(strides) == 1 and sample.row.values[0] == 0 and sample.row.values[-1] >= rows - strides[0], strides
+    print 'Sample of {} rows, every {}th row of the file'.format(len(sample), strides[0])
+
+def test_chunk_coerce():
+    "Check chunks with missing values and empty columns get the dtypes of the first chunk, which are widened."
+    processor = DataframeProcessor(pd.DataFrame())
+    chunks = [pd.DataFrame({'i': [1, 2], 'f': [1.5, 2.5], 's': ['a', 'b'], 'b': [True, False], 'e': [np.nan, np.nan]}),
+              pd.DataFrame({'i': [3, np.nan], 'f': [np.nan, np.nan], 's': ['c', np.nan], 'b': [np.nan, True], 'e': [1.0, 2.0]}),
+              pd.DataFrame({'i': [np.nan] * 2, 'f': [np.nan] * 2, 's': [np.nan] * 2, 'b': [np.nan] * 2, 'e': [3.0, np.nan]}, dtype=object)]
+    dtypes = {}
+    coerced = [processor._chunk_coerce(chunk, dtypes) for chunk in chunks]
+    for chunk in coerced:
+        assert dict(chunk.dtypes) == {'i': float, 'f': float, 's': object, 'b': object, 'e': float}, chunk.dtypes
+    try:
+        processor._chunk_coerce(pd.DataFrame({'f': ['x']}), dtypes)
+        assert False, 'Strings converted to float'
+    except ValueError:
+        pass
+
 def test_clean():
     import biz.pandas as bp
     odin = bp.read_source('odin', 'extract/odin_dump\.csv', max_level_date=0, reader_kwargs={'nrows': 10000})[-1]
@@ -1,5 +1,16 @@
 from __future__ import division
-import os, os.path
+import os, os.path, threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows, see msvcrt
+try:
+    import msvcrt, ctypes
+except ImportError:
+    msvcrt = None
+
+MOVEFILE_REPLACE_EXISTING = 0x1  # Flag of MoveFileEx (Windows), see replace_file
 
 ###############################################################################
 # This module contains helper-functions which all work on a pandas Series.
@@ -18,6 +29,111 @@ def mkdir(path, contains_file=True):
             except OSError:
                 pass
 
+def replace_file(source, destination):
+    """Replace the destination by the source-file, atomically: a reader sees either the old or the new file. On 
+    Windows os.rename can't overwrite, so MoveFileEx with MOVEFILE_REPLACE_EXISTING is used; it fails, like removing
+    the destination, while the destination is open or memory-mapped."""
+    if os.name == 'nt':
+        if not ctypes.windll.kernel32.MoveFileExW(unicode(source), unicode(destination), MOVEFILE_REPLACE_EXISTING):
+            raise ctypes.WinError()
+    else:
+        os.rename(source, destination)
+
+class FileLock(object):
+    """Exclusive lock on a lock-file, shared by all processes which use the file: an advisory lock (fcntl) or, on
+    Windows, a lock of the first byte of the file (msvcrt). Within a process the lock is reentrant and serializes
+    the threads; use get, for the lock of one file must be one object per process.
+    A shared lock (e.g. for readers) is held by any number of processes at the same time, but not together with 
+    an exclusive lock; a shared lock which is acquired exclusively in the same thread is upgraded. On Windows the 
+    shared lock is exclusive.
+    The lock-file holds a generation, which a writer of the locked file increases (see bump), so a reader which
+    keeps the file open can see that it was written, even when its size and mtime are unchanged.
+    Usage: with FileLock.get(filename + '.lock'): ...   or   with FileLock.get(filename + '.lock').shared(): ..."""
+    _locks = {}
+    _locks_lock = threading.Lock()
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+        self._shared = False
+    @classmethod
+    def get(cls, filename):
+        "Return the lock of the file, one object per file per process."
+        name = os.path.abspath(filename)
+        with cls._locks_lock:
+            if name not in cls._locks:
+                cls._locks[name] = cls(name)
+            return cls._locks[name]
+    def acquire(self, shared=False):
+        self._lock.acquire()
+        if self._depth == 0 or (self._shared and not shared):
+            try:
+                if self._file is None:
+                    mkdir(self.filename)
+                    self._file = open(self.filename, 'a+')
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                elif msvcrt is not None and self._depth == 0:
+                    self._file.seek(0)
+                    while True:
+                        try:
+                            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                            break
+                        except IOError:
+                            pass  # LK_LOCK gives up after 10 seconds; keep waiting
+                self._shared = shared
+            except:
+                if self._file is not None and self._depth == 0:
+                    self._file.close()
+                    self._file = None
+                self._lock.release()
+                raise
+        self._depth += 1
+    def release(self):
+        self._depth -= 1
+        try:
+            if self._depth == 0:
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+                    elif msvcrt is not None:
+                        self._file.seek(0)
+                        msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+                finally:
+                    self._file.close()
+                    self._file = None
+        finally:
+            self._lock.release()
+    def __enter__(self):
+        self.acquire()
+        return self
+    def __exit__(self, type, value, traceback):
+        self.release()
+    def generation(self):
+        "Return the generation of the locked file, see bump. The lock must be held."
+        self._file.seek(0)
+        try:
+            return int(self._file.read() or 0)
+        except ValueError:
+            return 0
+    def bump(self):
+        "Increase the generation, e.g. after writing the locked file in place. The lock must be held exclusively."
+        generation = self.generation() + 1
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(str(generation))
+        self._file.flush()
+        return generation
+    @contextmanager
+    def shared(self):
+        "Context manager for holding the lock shared."
+        self.acquire(True)
+        try:
+            yield self
+        finally:
+            self.release()
+
 def test():
     import biz.pandas as bp
 
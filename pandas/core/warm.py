@@ -0,0 +1,49 @@
+import sys, json, logging, argparse
+from biz.pandas.core.cache import read_source
+
+###############################################################################
+# Command line for warming the caches of a source-tree, see read_source.warm. E.g. after a new delivery landed:
+#   python -m biz.pandas.core.warm --levels /source/kpn/swol_marketing --pipeline input map --dates 2013-01: --workers 4
+# Files which are cached are skipped, so an interrupted run is resumed by running the same command again.
+###############################################################################
+
+def parse_key(text):
+    "Return the date-key for a text: a date, or a range 'start:stop' where start and stop may be empty."
+    if ':' not in text:
+        return text
+    start, stop = text.split(':', 1)
+    return slice(start or None, stop or None)
+
+def parse_option(text):
+    "Return the (name, value) of an option 'name=value'; the value is json, otherwise a string."
+    name, value = text.split('=', 1)
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+def main(argv=None):
+    "Warm the caches for the arguments (default sys.argv); return 1 when a file failed, else 0."
+    parser = argparse.ArgumentParser(description='Run the pipeline for all files whose result is not cached.')
+    parser.add_argument('--levels', help='The levels of the source, e.g. /source/kpn/swol_marketing')
+    parser.add_argument('--filename', help='Regular expression for the filenames of the source')
+    parser.add_argument('--pipeline', nargs='+', help='The pipeline-steps, e.g. input map')
+    parser.add_argument('--dates', default=':', help='A date or a range start:stop, e.g. 2013-01:2013-06 (default all)')
+    parser.add_argument('--files', help='Regular expression for the canonical filenames to warm (default all)')
+    parser.add_argument('--workers', type=int, help='The number of files processed in parallel')
+    parser.add_argument('--executor', choices=['thread', 'process'])
+    parser.add_argument('--option', action='append', default=[], metavar='NAME=VALUE',
+                        help='Other option of read_source, the value in json, e.g. cache_root=/cache or chunksize=100000')
+    parser.add_argument('--report', help='Write the report per file to this csv-file')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    options = dict([parse_option(option) for option in args.option])
+    src = read_source(levels=args.levels, filename=args.filename, pipeline=args.pipeline, **options)
+    report = src.warm(parse_key(args.dates), args.files, args.workers, args.executor)
+    if args.report:
+        report.to_csv(args.report)
+    print report.groupby('status').seconds.agg(['count', 'sum'])
+    return 1 if (report.status == 'failed').any() else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
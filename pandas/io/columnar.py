@@ -0,0 +1,201 @@
+import pandas as pd, numpy as np
+import os, json, struct, cPickle
+from collections import OrderedDict
+from biz.pandas.core.utils import replace_file
+
+###############################################################################
+# This module contains a columnar file-format for dataframes, in the spirit of Feather/Parquet:
+# one file per dataframe, with a json-header and the column-data in aligned binary buffers.
+# - Columns of the same numeric (int, float, bool, datetime) dtype are stored together as one 2-d buffer in
+#   the layout pandas uses for its blocks, so reading is a memory-map without copying the data.
+# - String-columns are dictionary-encoded: the distinct values (utf-8) and a code per row. Unicode is preserved.
+# - All other object-columns (mixed types) are pickled.
+# The file is written to a temporary file and renamed, so a reader never sees a half-written file.
+###############################################################################
+
+MAGIC = 'BIZCOL1\n'
+ALIGNMENT = 64
+
+def _aligned(position):
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _name(name):
+    "Json returns unicode and lists; return the original str- and tuple-names."
+    if isinstance(name, list):
+        return tuple([_name(n) for n in name])
+    if isinstance(name, unicode):
+        try:
+            return str(name)
+        except UnicodeEncodeError:
+            pass
+    return name
+
+def _encode_objects(values):
+    """Return the kind, the buffers and the encoding for an object-column: 'strings' when all values
+    are strings (or null), otherwise 'pickle'."""
+    present = values[pd.notnull(values)]
+    if all([isinstance(v, str) for v in present]):
+        encoding = None
+    elif all([isinstance(v, basestring) for v in present]):
+        encoding = 'utf-8'
+    else:
+        return 'pickle', {'data': np.array(bytearray(cPickle.dumps(values, 2)), dtype=np.uint8)}, None
+    codes, uniques = pd.factorize(values)
+    encoded = [u.encode(encoding) if encoding else u for u in uniques]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    return 'strings', {'codes': codes.astype(np.int32), 'offsets': offsets,
+                       'data': np.array(bytearray(''.join(encoded)), dtype=np.uint8)}, encoding
+
+def _decode_objects(description, buffers):
+    "Return the object-array of a 'strings' or 'pickle' column."
+    if description['kind'] == 'pickle':
+        return cPickle.loads(buffers['data'].tostring())
+    offsets, data = buffers['offsets'], buffers['data'].tostring()
+    encoding = description.get('encoding')
+    uniques = np.empty(len(offsets), dtype=object)  # Last position is the NaN for code -1
+    uniques[:-1] = [data[offsets[i]:offsets[i + 1]].decode(encoding) if encoding else data[offsets[i]:offsets[i + 1]]
+                    for i in range(len(offsets) - 1)]
+    uniques[-1] = np.nan
+    return uniques.take(buffers['codes'])
+
+def write_frame(filename, df, attrs=None):
+    "Write the dataframe to the columnar file; the attrs (json-serializable) are stored in the header."
+    buffers = []
+    def add(array):
+        array = np.ascontiguousarray(array)
+        buffers.append(array)
+        return {'buffer': len(buffers) - 1, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+    def objects(name, values):
+        kind, arrays, encoding = _encode_objects(values)
+        return {'name': name, 'kind': kind, 'encoding': encoding, 'buffers': {k: add(v) for k, v in arrays.items()}}
+    header = {'rows': len(df), 'attrs': attrs or {}, 'columns': [], 'groups': [], 'index': []}
+    # Group the numeric columns by dtype, one 2-d buffer per dtype:
+    groups = OrderedDict()
+    for i, name in enumerate(df.columns):
+        values = df.iloc[:, i].values
+        if values.dtype == object:
+            header['columns'].append(objects(name, values))
+        else:
+            group = groups.setdefault(values.dtype.str, [])
+            header['columns'].append({'name': name, 'kind': 'array', 'group': groups.keys().index(values.dtype.str), 'position': len(group)})
+            group.append(values)
+    header['groups'] = [add(np.vstack(group) if group else np.empty((0, len(df)))) for group in groups.values()]
+    index = df.index
+    for level, name in zip(range(index.nlevels), index.names):
+        values = index.get_level_values(level).values if index.nlevels > 1 else index.values
+        header['index'].append(objects(name, values) if values.dtype == object else {'name': name, 'kind': 'array', 'buffers': {'data': add(values)}})
+    # Compute the offsets of the buffers, relative to the start of the data:
+    position = 0
+    descriptions = {}
+    for i, array in enumerate(buffers):
+        descriptions[i] = position
+        position = _aligned(position + array.nbytes)
+    def offsets(item):
+        if isinstance(item, dict):
+            if 'buffer' in item:
+                item['offset'] = descriptions[item.pop('buffer')]
+            for v in item.values(): offsets(v)
+        elif isinstance(item, list):
+            for v in item: offsets(v)
+    offsets(header)
+    header_json = json.dumps(header)
+    data_start = _aligned(len(MAGIC) + 8 + len(header_json))
+    filename_tmp = filename + '.tmp'
+    with open(filename_tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_json)))
+        f.write(header_json)
+        for i, array in enumerate(buffers):
+            f.seek(data_start + descriptions[i])
+            array.tofile(f)
+    replace_file(filename_tmp, filename)
+
+def read_header(filename):
+    "Return the header of the columnar file, with the absolute start of the data in data_start."
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise IOError('Not a columnar file: "{}"'.format(filename))
+        size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(size))
+    header['data_start'] = _aligned(len(MAGIC) + 8 + size)
+    return header
+
+def _buffer(filename, header, description):
+    "Return the buffer of the description, memory-mapped."
+    shape = tuple(description['shape'])
+    if not np.prod(shape):
+        return np.empty(shape, dtype=description['dtype'])
+    return np.memmap(filename, description['dtype'], 'r', header['data_start'] + description['offset'], shape)
+
+def read_frame(filename, columns=None):
+    """Read the dataframe from the columnar file. When columns are specified, only these are read.
+    The numeric data is memory-mapped; when the pandas-internals allow it, the dataframe is built on the
+    memory-mapped blocks without copying, otherwise the data is copied once."""
+    header = read_header(filename)
+    rows = header['rows']
+    def buffer(description):
+        return _buffer(filename, header, description)
+    def values(description):
+        buffers = {k: buffer(v) for k, v in description['buffers'].items()}
+        return buffers['data'] if description['kind'] == 'array' else _decode_objects(description, buffers)
+    # Index:
+    levels = [pd.Index(values(d), name=_name(d['name'])) for d in header['index']]
+    index = levels[0] if len(levels) == 1 else pd.MultiIndex.from_arrays(levels, names=[level.name for level in levels])
+    # Columns; select the requested columns and keep them in the order of the file:
+    descriptions = [d for d in header['columns'] if columns is None or _name(d['name']) in columns]
+    names = pd.Index([_name(d['name']) for d in descriptions])
+    blocks = []  # Pairs of column-names and 2-d values in block-layout
+    for g, group in enumerate(header['groups']):
+        members = [d for d in descriptions if d['kind'] == 'array' and d['group'] == g]
+        if not members: continue
+        data = buffer(group)
+        positions = [d['position'] for d in members]
+        blocks.append(([_name(d['name']) for d in members],
+                       data if positions == range(data.shape[0]) else data[positions]))
+    objects = [d for d in descriptions if d['kind'] != 'array']
+    if objects:
+        data = np.empty((len(objects), rows), dtype=object)
+        for i, d in enumerate(objects):
+            data[i] = values(d)
+        blocks.append(([_name(d['name']) for d in objects], data))
+    try:
+        from pandas.core.internals import BlockManager, make_block
+        if names.is_unique and len(blocks) > 1:
+            manager = BlockManager([make_block(data, pd.Index(items), names) for items, data in blocks], [names, index])
+            return pd.DataFrame(manager)
+    except (ImportError, TypeError, ValueError, AssertionError):
+        pass  # Other internals; build the frame by copying the blocks
+    if len(blocks) == 1 and names.is_unique:
+        return pd.DataFrame(blocks[0][1].T, index=index, columns=blocks[0][0]).reindex(columns=names, copy=False)
+    frame = pd.DataFrame(index=index)
+    for items, data in blocks:
+        for item, column in zip(items, data):
+            frame[item] = column
+    return frame[names] if len(names) else frame
+
+def read_column(filename, name, start=0, stop=None, header=None):
+    """Read the values of the rows start:stop of a column, without reading the other rows: the numeric values are
+    a memory-mapped view, of a strings-column only the distinct values in these rows are decoded. Pass the header
+    (see read_header) when reading many slices, so it is read only once."""
+    header = header or read_header(filename)
+    descriptions = [d for d in header['columns'] if _name(d['name']) == name]
+    if not descriptions:
+        raise KeyError('Column "{}" not in "{}"'.format(name, filename))
+    description = descriptions[0]
+    if description['kind'] == 'array':
+        return _buffer(filename, header, header['groups'][description['group']])[description['position'], start:stop]
+    buffers = {k: _buffer(filename, header, v) for k, v in description['buffers'].items()}
+    if description['kind'] == 'pickle':
+        return _decode_objects(description, buffers)[start:stop]
+    codes, positions = np.unique(buffers['codes'][start:stop], return_inverse=True)
+    offsets, data, encoding = buffers['offsets'], buffers['data'], description.get('encoding')
+    uniques = np.empty(len(codes), dtype=object)
+    for i, code in enumerate(codes):
+        value = data[offsets[code]:offsets[code + 1]].tostring() if code >= 0 else np.nan
+        uniques[i] = value.decode(encoding) if encoding and code >= 0 else value
+    return uniques.take(positions)
+
+def read_attrs(filename):
+    "Return the attributes, stored with the dataframe, without reading the data."
+    return read_header(filename)['attrs']
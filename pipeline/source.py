@@ -11,17 +11,33 @@ import isounidecode as _isounidecode, hashlib as _hashlib
 
 def input(df):
     """Read the specified file with the specified arguents (if present). The string contents are flattened:
-    all special characters (e.g. with diacrits, chinese etc) are converted to ascii-characters."""
+    all special characters (e.g. with diacrits, chinese etc) are converted to ascii-characters, see flatten_strings.
+    When the file is computed in chunks, the rows of the current chunk are returned."""
     import biz.pandas as bp
-    result = bp.read_file(df._biz_processor.filename, **df._biz_processor.reader_kwargs).applymap(_flatten)
-    return result if result is not None else pd.DataFrame()
+    from biz.pandas.core.frame import flatten_strings
+    processor = df._biz_processor
+    result = processor.chunk if processor.chunk is not None else bp.read_file(processor.filename, **processor.reader_kwargs)
+    return flatten_strings(result) if result is not None else pd.DataFrame()
 
 def map(df):
     """Return a dataframe with all columns mapped to the best fitting type. When only 1 (should be parameter in future!)
     column of a certain type is found, rename it to the name of the type. When e.g. one column named 'POSTCODE_CORR' 
     contains a zipcode, it is renamed to 'zipcode'. When more than one is found, keep the original names.
+    The columns of an outdated cached result with an unchanged column-hash are reused, see map_attrs.
+    When the file is computed in chunks, every chunk is mapped with the matches of the sample, see map_sample.
     Last changed: 2014-02-16"""
-    return df._biz_metadata.map(df)
+    processor = df._biz_processor
+    if processor.chunk is not None:
+        return df._biz_metadata.map(df, matches=processor.chunk_state.get('map'))
+    return df._biz_metadata.map(df, previous=processor.stale('map'))
+
+def map_sample(df):
+    "Return the matches of the columns for a sample of a file which is computed in chunks, so the types are detected once."
+    return df._biz_metadata.match(df)
+
+def map_attrs(df):
+    "Return the hashes per column of the mapped dataframe, which are stored with the cached result."
+    return {'column_hashes': getattr(df._biz_metadata, 'column_hashes', {})}
 
 def map_hash(df):
     """Return the attrs from the metadata-file, if any.